@@ -1,19 +1,103 @@
 import numpy as np
 
 class Activate:
+    """
+        Activation functions and their derivatives.
+        All of them accept an optional `out` array, in which the result
+        is written instead of allocating a new one. out may be x itself.
+
+        Functions named d<name> take the same input as <name>, while
+        d<name>_from_output take the output of <name> instead, so that
+        backpropagation can reuse the values of the forward pass.
+    """
+    # Slope of leaky_relu for negative inputs
+    leak = 0.01
+
+    # name -> (function, derivative from output)
+    registry = dict()
+
+    @classmethod
+    def register(cls, name, function, derivative):
+        """
+            Registers an activation under `name`.
+            function(x, out=None)   -> the activation itself.
+            derivative(y, out=None) -> its derivative, where
+                                       y = function(x).
+        """
+        cls.registry[name] = (function, derivative)
+
+    @classmethod
+    def get(cls, name):
+        """ Returns the (function, derivative) pair registered as `name`. """
+        return cls.registry[name]
+
+    @staticmethod
+    def sigmoid(x, out=None):
+        out = np.negative(x, out=out)
+        np.exp(out, out=out)
+        out += 1
+        return np.reciprocal(out, out=out)
+
+    @staticmethod
+    def dsigmoid(x, out=None):
+        return Activate.dsigmoid_from_output(Activate.sigmoid(x, out=out), out=out)
+
+    @staticmethod
+    def dsigmoid_from_output(y, out=None):
+        # y*(1-y) == 1/4 - (y - 1/2)**2, which needs no temporary
+        out = np.subtract(y, 0.5, out=out)
+        np.square(out, out=out)
+        return np.subtract(0.25, out, out=out)
+
     @staticmethod
-    def sigmoid(x):
-        return 1/(1 + np.exp(-x))
+    def tanh(x, out=None):
+        return np.tanh(x, out=out)
 
     @staticmethod
-    def dsigmoid(x):
-        s = Activate.sigmoid(x)
-        return s*(1-s)
+    def dtanh(x, out=None):
+        return Activate.dtanh_from_output(Activate.tanh(x, out=out), out=out)
 
     @staticmethod
-    def tanh(x):
-        return 2/(1 + np.exp(-2*x)) - 1
+    def dtanh_from_output(y, out=None):
+        out = np.square(y, out=out)
+        return np.subtract(1, out, out=out)
 
     @staticmethod
-    def dtanh(x):
-        return 1 - Activate.tanh(x)**2
+    def relu(x, out=None):
+        return np.maximum(x, 0, out=out)
+
+    @staticmethod
+    def drelu(x, out=None):
+        return Activate.drelu_from_output(x, out=out)
+
+    @staticmethod
+    def drelu_from_output(y, out=None):
+        # relu(x) > 0 exactly when x > 0
+        if out is None:
+            out = np.empty_like(y)
+        return np.greater(y, 0, out=out)
+
+    @staticmethod
+    def leaky_relu(x, out=None):
+        if out is None or np.may_share_memory(x, out):
+            # x*leak goes to a temporary, as out may be x
+            return np.maximum(x, np.multiply(x, Activate.leak), out=out)
+        np.multiply(x, Activate.leak, out=out)
+        return np.maximum(x, out, out=out)
+
+    @staticmethod
+    def dleaky_relu(x, out=None):
+        return Activate.dleaky_relu_from_output(x, out=out)
+
+    @staticmethod
+    def dleaky_relu_from_output(y, out=None):
+        # leaky_relu keeps the sign of x
+        out = Activate.drelu_from_output(y, out=out)
+        out *= 1 - Activate.leak
+        out += Activate.leak
+        return out
+
+for name in ('sigmoid', 'tanh', 'relu', 'leaky_relu'):
+    Activate.register(name,
+                      getattr(Activate, name),
+                      getattr(Activate, 'd' + name + '_from_output'))
@@ -0,0 +1,16 @@
+from collections import deque
+
+def bounded_imap(pool, function, tasks, window):
+    """
+        function(task) of every task, in order, mapped in pool.
+        Unlike pool.imap, which reads all tasks ahead into the queue of
+        the pool, at most window tasks are read and not yet returned at
+        a time, so tasks can be a stream bigger than memory.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
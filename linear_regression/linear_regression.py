@@ -1,4 +1,6 @@
 import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
 # Adds higher directory to python modules path.
 import sys
 import os
@@ -18,53 +20,208 @@ class LinearRegresionMatrix(BaseLearning):
         """ Common class for errors thrown by LinearRegression. """
         pass
 
-    def __init__(self, data, results):
+    SOLVERS = ('lstsq', 'qr', 'cholesky')
+
+    def __init__(self, data, results, refit_every=1000):
         """
             Initializes linear regression model with training data set.
             data (list|tuple)    -> list containing points in nth-dimension.
                                     example: [(0.3, 0.5, 3), (4.3, 4.9, 1)]
             results (list|tuple) -> list containing the answers for the data.
                                     example: [0.3, 800.2, 123.4]
+            refit_every (int)    -> after this many rows are added or
+                                    forgotten by partial_fit() and forget(),
+                                    the plane is solved again from scratch,
+                                    so rounding errors do not pile up.
             constraint: len(data) == len(results)
             constraint: len(data[0]) == len(data[1]) == len(data[2])...
         """
 
         self.X = self.build_matrix(data)
-        self.data = list(data)
-        self.results = list(results)
+        # views and arrays, so that the data set is not kept three times
+        self.data = self.X[:, 1:]
+        self.results = np.array(results, dtype=float)
+        if len(self.results) != len(self.X):
+            raise self.LinearRegresionError('data and results must be of '
+                                            'equal length')
         self.pseudo_inverse_X = None
         self.plane = None
+        self.penalty = 0.0
+        self.refit_every = refit_every
+        # X^T X, X^T y and the inverse of X^T X of the rows seen by
+        # partial_fit() and forget(), built on their first call
+        self.gram = None
+        self.moment = None
+        self.inverse = None
+        self.updated_rows = 0
+
+    def train(self, solver='lstsq', penalty=0.0):
+        """
+            Trains linear regression: finds the plane w that minimizes
+            the squared error |Xw - y|^2, without building the
+            pseudo-inverse of X.
+            penalty (float) -> if set, trains ridge regression instead,
+                               minimizing |Xw - y|^2 + penalty*|w|^2
+                               (the threshold w0 is not penalized),
+                               from an eigendecomposition of the data.
+                               solver is not used then.
+            solver (str) -> 'lstsq'    : SVD based least squares. Works
+                                         even if X is rank deficient.
+                            'qr'       : QR decomposition of X. Cheaper,
+                                         X must have full column rank.
+                            'cholesky' : Cholesky decomposition of the
+                                         normal equations X^T X w = X^T y.
+                                         Cheapest, only the (d+1, d+1)
+                                         matrix X^T X is factored, but it
+                                         squares the condition number of X.
+        """
+        if solver not in self.SOLVERS:
+            raise self.LinearRegresionError('solver must be one of '
+                                            + ', '.join(self.SOLVERS))
+        y = self.results
+        if penalty:
+            self.plane = _ridge_planes(self.X[:, 1:], y, [penalty])[:, 0]
+        else:
+            try:
+                self.plane = getattr(self, '_solve_' + solver)(self.X, y)
+            except np.linalg.LinAlgError as ex:
+                raise self.LinearRegresionError('numpy error: ' + str(ex)
+                                                + '\n\tX^T X is singular, '
+                                                'use solver=\'lstsq\'')
+        self.penalty = float(penalty)
+        self.pseudo_inverse_X = None
+        # rows added or forgotten before are dropped
+        self.gram = self.moment = self.inverse = None
+
+    def ridge_path(self, penalties, folds=5, workers=None, seed=None):
+        """
+            Chooses the ridge penalty with the smallest K-fold
+            cross-validation error, and trains with it.
+            Each fold factors its training rows with a single
+            eigendecomposition, from which the planes of all penalties
+            come in closed form, so
+            trying many penalties costs about the same as trying one.
+            penalties (list) -> the penalties tried.
+            folds (int)      -> amount of folds.
+            workers (int)    -> if set, folds run in a pool of this many
+                                processes, which read the rows from
+                                shared memory.
+            seed (int)       -> seeds the split of rows in folds.
+            returns: (dict)
+                penalties    -> the penalties tried
+                errors       -> average squared validation error of each
+                                penalty, averaged over the folds
+                best_penalty -> the penalty trained
+                best_error   -> its error
+        """
+        penalties = np.asarray(penalties, dtype=float)
+        if not 2 <= folds <= len(self.X):
+            raise self.LinearRegresionError('folds must be between 2 and '
+                                            'the amount of rows')
+        order = np.random.RandomState(seed).permutation(len(self.X))
+        tasks = [(np.sort(validation), penalties)
+                 for validation in np.array_split(order, folds)]
+        if workers is None:
+            _set_fold_data(self.X[:, 1:], self.results)
+            errors = [_fold_errors(task) for task in tasks]
+            _set_fold_data(None, None)
+        else:
+            shms = []
+            specs = []
+            try:
+                for array in (self.X, self.results):
+                    shm = shared_memory.SharedMemory(create=True,
+                                                     size=max(1, array.nbytes))
+                    shms.append(shm)
+                    np.ndarray(array.shape, dtype=array.dtype,
+                               buffer=shm.buf)[...] = array
+                    specs.append((shm.name, array.shape, array.dtype.str))
+                with mp.Pool(workers, initializer=_attach_fold_data,
+                             initargs=(specs,)) as pool:
+                    errors = pool.map(_fold_errors, tasks)
+            finally:
+                for shm in shms:
+                    shm.close()
+                    shm.unlink()
+        # folds weighted by their amount of rows
+        sizes = np.array([len(validation) for validation, _ in tasks])
+        errors = np.dot(sizes, errors)/sizes.sum()
+        best = int(np.argmin(errors))
+        self.train(penalty=penalties[best])
+        path = {
+            'penalties': penalties.tolist(),
+            'errors': errors.tolist(),
+            'best_penalty': float(penalties[best]),
+            'best_error': float(errors[best])
+        }
+        return path
+
+    def partial_fit(self, new_rows, new_results):
+        """
+            Adds new rows to the model and updates the plane right away,
+            with a rank-k update of the cached inverse of X^T X
+            (Sherman-Morrison-Woodbury), in O(d^2 k) for k rows.
+            The training data set, used by statistics(), is kept as is.
+            new_rows (list|array)    -> k points, as data in __init__.
+            new_results (list|array) -> the k answers for them.
+        """
+        self._update(new_rows, new_results, 1)
+
+    def forget(self, rows, results):
+        """
+            Removes rows added before (or from the training data set)
+            from the model, in O(d^2 k) for k rows, as partial_fit().
+        """
+        self._update(rows, results, -1)
 
-    def train(self):
+    def pseudo_inverse(self):
         """
-            Trains linear regression (which just calculates the
-            pseudo-inverse of X)
+            Returns the pseudo-inverse of X, a (d+1, N) matrix,
+            calculating it on the first call.
         """
-        self.pseudo_inverse_X = np.linalg.pinv(self.X)
-        print(self.pseudo_inverse_X)
-        y = np.array([[i] for i in self.results])
-        self.plane = (self.pseudo_inverse_X * y).tolist()
-        self.plane = [i[0] for i in self.plane]
+        if self.pseudo_inverse_X is None:
+            self.pseudo_inverse_X = np.linalg.pinv(self.X)
+        return self.pseudo_inverse_X
 
-    def statistics(self):
+    def statistics(self, pseudo_inverse=False, chunk_size=65536):
         """
             All statistics available:
+            squared_error     (float) -> How much does the plane miss
+                                         the real data set?
+            avg_squared_error (float)
+            max_error         (float) -> The biggest absolute residual
+            r2                (float) -> Coefficient of determination
             pseudo_inverse (list[list]) -> The calculated pseudo inverse of
-                                           the initial matrix of data
-            squared_error  (float)      -> How much does the pseudo_inverse
-                                           matrix misses the real data set?
+                                           the initial matrix of data.
+                                           Only if pseudo_inverse is set,
+                                           as it is a (d+1, N) matrix.
+            The residuals are summarized in a single pass over the data
+            set, chunk_size rows at a time, so the extra memory does not
+            grow with it.
         """
-        if self.pseudo_inverse_X is None:
-            raise LinearRegresionError('LinearRegression was not trained. '
-                                       'Use train() before using statistics()')
-        squared_error = 0
-        for datapoint, result in zip(self.data, self.results):
-            squared_error += (self.apply(datapoint) - result)**2
+        if self.plane is None:
+            raise self.LinearRegresionError('LinearRegression was not trained. '
+                                            'Use train() before using statistics()')
+        mean = self.results.mean()
+        squared_error = 0.0
+        max_error = 0.0
+        variance = 0.0
+        for begin in range(0, len(self.X), chunk_size):
+            results = self.results[begin:begin + chunk_size]
+            residuals = self.apply_many(self.data[begin:begin + chunk_size])
+            residuals -= results
+            squared_error += float(residuals.dot(residuals))
+            max_error = max(max_error, float(np.abs(residuals).max()))
+            deviations = results - mean
+            variance += float(deviations.dot(deviations))
         statistics = {
-            'pseudo_inverse': np.matrix.tolist(self.pseudo_inverse_X),
             'squared_error': squared_error,
-            'avg_squared_error': squared_error / len(self.results)
+            'avg_squared_error': squared_error / len(self.results),
+            'max_error': max_error,
+            'r2': 1 - squared_error/variance if variance else 1.0
         }
+        if pseudo_inverse:
+            statistics['pseudo_inverse'] = self.pseudo_inverse().tolist()
         return statistics
 
     def apply(self, datapoint):
@@ -76,12 +233,30 @@ class LinearRegresionMatrix(BaseLearning):
             returns: the prediction of the value of the datapoint.
         """
         # transposed(w) * x
-        if self.pseudo_inverse_X is None:
-            raise LinearRegresionError('LinearRegression was not trained.'
-                                       ' Use train() before using apply()')
-        s = self.plane[0]
-        s += sum([self.plane[idx + 1] * x for idx, x in enumerate(datapoint)])
-        return s
+        if self.plane is None:
+            raise self.LinearRegresionError('LinearRegression was not trained.'
+                                            ' Use train() before using apply()')
+        return float(self.plane[0] + self.plane[1:].dot(datapoint))
+
+    def apply_many(self, points):
+        """
+            Applies linear regression to many datapoints at once, with a
+            single matrix-vector product.
+            points (array) -> (n, d) matrix, one point per row.
+            returns: (array) the n predictions.
+        """
+        if self.plane is None:
+            raise self.LinearRegresionError('LinearRegression was not trained.'
+                                            ' Use train() before using apply_many()')
+        points = np.asarray(points, dtype=float)
+        if points.ndim != 2 or points.shape[1] != len(self.plane) - 1:
+            raise self.LinearRegresionError('points must be a matrix with one '
+                                            'point of dimension '
+                                            + str(len(self.plane) - 1)
+                                            + ' per row')
+        predictions = points.dot(self.plane[1:])
+        predictions += self.plane[0]
+        return predictions
 
     @classmethod
     def build_matrix(cls, data):
@@ -97,12 +272,143 @@ class LinearRegresionMatrix(BaseLearning):
                 ]
         """
         try:
-            return np.matrix([[1] + i for i in data])
-        except TypeError as ex:
-            raise LinearRegresionError('numpy error: '
-                                       + str(ex)
-                                       + '\n\tProbably len(xi) != len(xj)'
-                                       + 'for some i, j in the dataset')
+            points = np.asarray(data, dtype=float)
+        except (TypeError, ValueError) as ex:
+            raise cls.LinearRegresionError('numpy error: '
+                                           + str(ex)
+                                           + '\n\tProbably len(xi) != len(xj)'
+                                           + 'for some i, j in the dataset')
+        if points.ndim != 2:
+            raise cls.LinearRegresionError('data must be a list of points '
+                                           'of the same dimension')
+        X = np.empty((len(points), points.shape[1] + 1))
+        X[:, 0] = 1
+        X[:, 1:] = points
+        return X
+
+    # private
+
+    def _update(self, rows, results, sign):
+        """
+            Adds (sign = 1) or removes (sign = -1) the rows U from the
+            model. With P the inverse of X^T X:
+                K = P U^T (sign I + U P U^T)^-1
+                P <- P - K U P
+                w <- w + K (y - U w)
+        """
+        U = self.build_matrix(rows)
+        y = np.asarray(results, dtype=float)
+        if U.shape[1] != self.X.shape[1] or len(U) != len(y):
+            raise self.LinearRegresionError('rows must be points of the same '
+                                            'dimension of data, one per result')
+        if self.inverse is None:
+            self.gram = self.X.T.dot(self.X)
+            # ridge adds the penalty to the diagonal, but the threshold's
+            diagonal = np.arange(1, len(self.gram))
+            self.gram[diagonal, diagonal] += self.penalty
+            self.moment = self.X.T.dot(self.results)
+            self._refit()
+        PU = self.inverse.dot(U.T)
+        S = U.dot(PU)
+        S[np.diag_indices_from(S)] += sign
+        try:
+            # S is symmetric, so K^T = S^-1 (P U^T)^T
+            K = np.linalg.solve(S, PU.T).T
+        except np.linalg.LinAlgError:
+            raise self.LinearRegresionError('X^T X would be singular '
+                                            'without these rows')
+        self.plane += K.dot(y - U.dot(self.plane))
+        self.inverse -= K.dot(PU.T)
+        self.gram += sign*U.T.dot(U)
+        self.moment += sign*U.T.dot(y)
+        self.updated_rows += len(U)
+        if self.updated_rows >= self.refit_every:
+            self._refit()
+
+    def _refit(self):
+        """ Solves the plane and the inverse again from X^T X and X^T y. """
+        try:
+            L_inverse = np.linalg.inv(np.linalg.cholesky(self.gram))
+        except np.linalg.LinAlgError as ex:
+            raise self.LinearRegresionError('numpy error: ' + str(ex)
+                                            + '\n\tX^T X is singular')
+        # (L L^T)^-1 = L^-T L^-1
+        self.inverse = L_inverse.T.dot(L_inverse)
+        self.plane = self.inverse.dot(self.moment)
+        self.updated_rows = 0
+
+    @staticmethod
+    def _solve_lstsq(X, y):
+        return np.linalg.lstsq(X, y, rcond=None)[0]
+
+    @staticmethod
+    def _solve_qr(X, y):
+        # X = QR, so Rw = Q^T y
+        Q, R = np.linalg.qr(X)
+        return np.linalg.solve(R, Q.T.dot(y))
+
+    @staticmethod
+    def _solve_cholesky(X, y):
+        # X^T X = L L^T, so L z = X^T y and L^T w = z
+        L = np.linalg.cholesky(X.T.dot(X))
+        return np.linalg.solve(L.T, np.linalg.solve(L, X.T.dot(y)))
+
+# ridge regression and the functions of the cross-validation workers
+
+def _ridge_planes(data, y, penalties):
+    """
+        Ridge planes of (data, y), one column per penalty, from a single
+        eigendecomposition of the (d, d) matrix C^T C, where C is data
+        with its columns centered, so the threshold is not penalized.
+        With C^T C = V diag(e) V^T:
+            w = V diag(1/(e + penalty)) V^T C^T (y - mean(y))
+            w0 = mean(y) - mean(data) w
+    """
+    center = data.mean(axis=0)
+    mean = y.mean()
+    # C is built, as data^T data - n*center center^T loses the
+    # precision of columns with big means
+    C = data - center
+    gram = C.T.dot(C)
+    moment = C.T.dot(y - mean)
+    del C
+    e, V = np.linalg.eigh(gram)
+    # eigenvalues of a Gram matrix are >= 0, but for rounding
+    np.maximum(e, 0, out=e)
+    factors = 1/(e[:, None] + np.asarray(penalties)[None, :])
+    planes = np.empty((data.shape[1] + 1, len(penalties)))
+    planes[1:] = V.dot(factors*V.T.dot(moment)[:, None])
+    planes[0] = mean - center.dot(planes[1:])
+    return planes
+
+# Dataset of each cross-validation process, in shared memory in a pool
+_fold_data = dict()
+
+def _set_fold_data(data, y):
+    _fold_data["data"] = data
+    _fold_data["y"] = y
+
+def _attach_fold_data(specs):
+    arrays = []
+    for name, shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        _fold_data.setdefault("shms", []).append(shm)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    X, y = arrays
+    _set_fold_data(X[:, 1:], y)
+
+def _fold_errors(task):
+    """ Average squared validation error of every penalty in a fold. """
+    validation, penalties = task
+    data, y = _fold_data["data"], _fold_data["y"]
+    training = np.ones(len(data), dtype=bool)
+    training[validation] = False
+    planes = _ridge_planes(data[training], y[training], penalties)
+    # predictions of all penalties in one product
+    residuals = data[validation].dot(planes[1:])
+    residuals += planes[0]
+    residuals -= y[validation][:, None]
+    return np.mean(residuals**2, axis=0)
 
 if __name__ == '__main__':
     from data import INPUT, RESULTS
@@ -0,0 +1,221 @@
+import numpy as np
+import multiprocessing as mp
+# Adds higher directory to python modules path.
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# local inclusions
+from base.base_learning import BaseLearning
+from base.base_pool import bounded_imap
+from linear_regression import LinearRegresionMatrix
+
+class StreamingLinearRegression(BaseLearning):
+    """
+        Linear Regression for datasets that do not fit in memory.
+        Rows are read chunk by chunk and only the sufficient statistics
+        X^T X, X^T y and y^T y are kept, so memory is O(d^2) no matter
+        how many rows there are. The plane is solved once, at train().
+    """
+
+    LinearRegresionError = LinearRegresionMatrix.LinearRegresionError
+    SOLVERS = ('cholesky', 'lstsq')
+
+    def __init__(self):
+        # X^T X and X^T y, with the column of ones of X included
+        self.gram = None
+        self.moment = None
+        self.squared_results = 0.0
+        self.count = 0
+        self.plane = None
+
+    def update(self, data, results):
+        """
+            Adds a chunk of rows to the statistics.
+            data (array)    -> (n, d) matrix, one point per row.
+            results (array) -> the n answers for the data.
+        """
+        self._add(*_chunk_statistics(data, results))
+
+    def fit(self, chunks, workers=None):
+        """
+            Reads all chunks into the statistics, and trains.
+            chunks (iterable) -> (data, results) pairs, as in update().
+            workers (int)     -> if set, the statistics of the chunks are
+                                 calculated in a pool of this many
+                                 processes, and summed here.
+        """
+        self._reduce(_pair_statistics, chunks, workers)
+        self.train()
+
+    def fit_file(self, data, results, chunk_size=65536, workers=None):
+        """
+            Reads all rows of data and results, chunk_size rows at a
+            time, into the statistics, and trains.
+            data, results (str|array) -> paths of .npy files, which are
+                                         memory mapped, or arrays.
+            workers (int)             -> if set, rows are split in shards
+                                         read by a pool of this many
+                                         processes. Paths are opened by
+                                         each worker on its own, so no
+                                         data goes through the pool;
+                                         arrays are sent one shard per
+                                         task.
+        """
+        if isinstance(data, str):
+            rows = len(np.load(data, mmap_mode='r'))
+        else:
+            rows = len(data)
+        # a few shards per worker, so that they end together
+        shards = 1 if workers is None else 4*workers
+        bounds = np.linspace(0, rows, shards + 1).astype(int)
+        tasks = (_shard(data, results, begin, end, chunk_size)
+                 for begin, end in zip(bounds, bounds[1:]) if end > begin)
+        self._reduce(_shard_statistics, tasks, workers)
+        self.train()
+
+    def train(self, solver='cholesky'):
+        """
+            Solves the normal equations X^T X w = X^T y.
+            solver (str) -> 'cholesky' : Cholesky decomposition of X^T X.
+                            'lstsq'    : least squares over X^T X, for when
+                                         it is singular.
+        """
+        if self.count == 0:
+            raise self.LinearRegresionError('no rows were given. Use update() '
+                                            'or fit() before train()')
+        if solver not in self.SOLVERS:
+            raise self.LinearRegresionError('solver must be one of '
+                                            + ', '.join(self.SOLVERS))
+        if solver == 'lstsq':
+            self.plane = np.linalg.lstsq(self.gram, self.moment, rcond=None)[0]
+            return
+        try:
+            L = np.linalg.cholesky(self.gram)
+        except np.linalg.LinAlgError as ex:
+            raise self.LinearRegresionError('numpy error: ' + str(ex)
+                                            + '\n\tX^T X is singular, '
+                                            'use solver=\'lstsq\'')
+        self.plane = np.linalg.solve(L.T, np.linalg.solve(L, self.moment))
+
+    def statistics(self):
+        """
+            All statistics available:
+            rows              (int)   -> How many rows were read
+            squared_error     (float) -> How much does the plane miss
+                                         the rows read?
+            avg_squared_error (float)
+            Calculated from the sufficient statistics, without reading
+            the rows again.
+        """
+        if self.plane is None:
+            raise self.LinearRegresionError('LinearRegression was not trained. '
+                                            'Use train() before using statistics()')
+        # |Xw - y|^2 = y^T y - 2 w^T X^T y + w^T X^T X w
+        squared_error = (self.squared_results - 2*self.plane.dot(self.moment)
+                         + self.plane.dot(self.gram.dot(self.plane)))
+        squared_error = max(0.0, float(squared_error))
+        statistics = {
+            'rows': self.count,
+            'squared_error': squared_error,
+            'avg_squared_error': squared_error / self.count
+        }
+        return statistics
+
+    def apply(self, datapoint):
+        """
+            Applies linear regression to datapoint.
+            datapoint (list) -> A data point with the same dimension of
+                                the data read.
+            returns: the prediction of the value of the datapoint.
+        """
+        if self.plane is None:
+            raise self.LinearRegresionError('LinearRegression was not trained.'
+                                            ' Use train() before using apply()')
+        return float(self.plane[0] + self.plane[1:].dot(datapoint))
+
+    # private
+
+    def _add(self, gram, moment, squared_results):
+        """ Adds the statistics of some rows. """
+        if self.gram is None:
+            self.gram = np.zeros_like(gram)
+            self.moment = np.zeros_like(moment)
+        if gram.shape != self.gram.shape:
+            raise self.LinearRegresionError('rows do not have the dimension '
+                                            'of the previous ones')
+        self.gram += gram
+        self.moment += moment
+        self.squared_results += squared_results
+        self.count += int(gram[0, 0])
+
+    def _reduce(self, function, tasks, workers):
+        """ Adds function(task) of every task, mapped in a pool if set. """
+        if workers is None:
+            for task in tasks:
+                self._add(*function(task))
+            return
+        with mp.Pool(workers) as pool:
+            # in order, so that sums are the same in every run, and a
+            # few tasks ahead, so that a stream of chunks is not read
+            # whole into the pool
+            for statistics in bounded_imap(pool, function, tasks, 2*workers):
+                self._add(*statistics)
+
+# functions of the worker processes
+
+def _chunk_statistics(data, results):
+    """ X^T X, X^T y and y^T y of a chunk, with the column of ones. """
+    data = np.asarray(data, dtype=float)
+    results = np.asarray(results, dtype=float)
+    if data.ndim != 2 or len(data) != len(results):
+        raise LinearRegresionMatrix.LinearRegresionError(
+            'chunk must be an (n, d) matrix and n answers')
+    d = data.shape[1]
+    gram = np.empty((d + 1, d + 1))
+    gram[0, 0] = len(data)
+    gram[0, 1:] = gram[1:, 0] = data.sum(axis=0)
+    gram[1:, 1:] = data.T.dot(data)
+    moment = np.empty(d + 1)
+    moment[0] = results.sum()
+    moment[1:] = data.T.dot(results)
+    return gram, moment, float(results.dot(results))
+
+def _pair_statistics(chunk):
+    return _chunk_statistics(*chunk)
+
+def _shard(data, results, begin, end, chunk_size):
+    """ Task of rows [begin, end), with only those rows of arrays. """
+    if not isinstance(data, str):
+        data = data[begin:end]
+    if not isinstance(results, str):
+        results = results[begin:end]
+    return data, results, begin, end, chunk_size
+
+def _shard_statistics(task):
+    """
+        Statistics of rows [begin, end) of a pair of .npy paths, or of
+        the arrays of those rows.
+    """
+    data, results, begin, end, chunk_size = task
+    if isinstance(data, str):
+        data = np.load(data, mmap_mode='r')[begin:end]
+    if isinstance(results, str):
+        results = np.load(results, mmap_mode='r')[begin:end]
+    total = None
+    for first in range(0, end - begin, chunk_size):
+        last = min(first + chunk_size, end - begin)
+        statistics = _chunk_statistics(data[first:last], results[first:last])
+        if total is None:
+            total = list(statistics)
+        else:
+            for i in range(3):
+                total[i] += statistics[i]
+    return tuple(total)
+
+if __name__ == '__main__':
+    from data import INPUT, RESULTS
+    l = StreamingLinearRegression()
+    chunks = ((INPUT[i:i + 1000], RESULTS[i:i + 1000])
+              for i in range(0, len(INPUT), 1000))
+    l.fit(chunks)
+    print(l.plane, l.statistics())
@@ -0,0 +1,138 @@
+"""
+    Parallel hyperparameter search for SupervisedNetwork.
+    Trials run in a process pool. The dataset is written once to .npy
+    files that every worker opens as a read-only memory map, so it is never
+    pickled to them. Bad trials are stopped early with successive halving:
+    every rung trains the surviving trials up to a bigger amount of epochs
+    and keeps only the best 1/eta of them.
+"""
+
+import numpy as np
+import multiprocessing as mp
+import itertools
+import random
+import tempfile
+import time
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from supervised_network import SupervisedNetwork
+
+# Default search space
+SPACE = {
+    "hidden": [[2], [4], [8], [8, 4]],
+    "activate": ["tanh", "sigmoid", "relu"],
+    "lr": [0.01, 0.03, 0.1, 0.3],
+    "batch_size": [8, 32, 128]
+}
+
+def search(X, Y, space=SPACE, method="grid", trials=20, workers=None,
+           min_epochs=1, max_epochs=27, eta=3, validation=0.2, seed=None):
+    """
+        Searches the best hyperparameters to fit (X, Y).
+        space (dict)      -> lists of values for "hidden" (sizes of the
+                             hidden layers), "activate", "lr" and
+                             "batch_size".
+        method (str)      -> "grid" tries every combination, "random"
+                             samples `trials` of them.
+        workers (int)     -> size of the process pool.
+        min_epochs (int)  -> epochs of the first rung.
+        max_epochs (int)  -> epochs of the survivors of the last rung.
+        eta (int)         -> each rung keeps 1/eta of the trials and trains
+                             them eta times longer.
+        validation (float)-> fraction of the data kept out of training to
+                             score the trials.
+        returns: (list) one dict per trial, best first, with its
+                 hyperparameters, the epochs it trained, its validation
+                 error and its wall-clock time in seconds.
+    """
+    if method not in ("grid", "random"):
+        raise SupervisedNetwork.SupervisedNetworkError("method must be 'grid' "
+                                                       "or 'random'")
+    rand = random.Random(seed)
+    keys = ("hidden", "activate", "lr", "batch_size")
+    grid = [dict(zip(keys, values))
+            for values in itertools.product(*[space[k] for k in keys])]
+    if method == "random":
+        grid = [{k: rand.choice(space[k]) for k in keys} for i in range(trials)]
+
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float).reshape(len(X), -1)
+    order = np.random.RandomState(seed).permutation(len(X))
+    cut = max(1, int(len(X)*validation))
+
+    results = [dict(config, trial=i, epochs=0, error=float("inf"), seconds=0.0)
+               for i, config in enumerate(grid)]
+    networks = [None]*len(grid)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for name, data in (("X", X[order[cut:]]), ("Y", Y[order[cut:]]),
+                           ("Xval", X[order[:cut]]), ("Yval", Y[order[:cut]])):
+            paths.append(os.path.join(tmp, name + ".npy"))
+            np.save(paths[-1], data)
+        del X, Y
+
+        with mp.Pool(workers, initializer=_load_data, initargs=(paths,)) as pool:
+            alive = list(range(len(grid)))
+            budget = min_epochs
+            while True:
+                tasks = [(i, grid[i], networks[i], budget - results[i]["epochs"],
+                          rand.randrange(2**31))
+                         for i in alive]
+                for i, nn, error, seconds in pool.imap_unordered(_run_trial, tasks):
+                    networks[i] = nn
+                    results[i]["epochs"] = budget
+                    results[i]["error"] = error
+                    results[i]["seconds"] += seconds
+                if budget >= max_epochs:
+                    break
+                alive.sort(key=lambda i: results[i]["error"])
+                alive = alive[:max(1, len(alive)//eta)]
+                budget = min(budget*eta, max_epochs)
+                if len(alive) == 1:
+                    # nothing left to compare, the survivor goes to the end
+                    budget = max_epochs
+
+    # trials that went further come first
+    results.sort(key=lambda r: (-r["epochs"], r["error"]))
+    return results
+
+def print_results(results, top=None):
+    """ Prints the results of search() as a ranked table. """
+    print(f"{'rank':>4} {'hidden':>10} {'activate':>10} {'lr':>6} "
+          f"{'batch':>6} {'epochs':>6} {'error':>10} {'seconds':>8}")
+    for rank, r in enumerate(results[:top], 1):
+        print(f"{rank:>4} {str(r['hidden']):>10} {r['activate']:>10} "
+              f"{r['lr']:>6} {r['batch_size']:>6} {r['epochs']:>6} "
+              f"{r['error']:>10.5f} {r['seconds']:>8.2f}")
+
+# private
+
+# Dataset of each worker process, memory mapped
+_data = dict()
+
+def _load_data(paths):
+    for name, path in zip(("X", "Y", "Xval", "Yval"), paths):
+        _data[name] = np.load(path, mmap_mode="r")
+
+def _run_trial(task):
+    """ Trains a trial for more `epochs` epochs and scores it. """
+    i, config, nn, epochs, seed = task
+    start = time.perf_counter()
+    np.random.seed(seed)
+    if nn is None:
+        layers = [_data["X"].shape[1]] + list(config["hidden"]) + [_data["Y"].shape[1]]
+        nn = SupervisedNetwork(layers, config["activate"])
+    nn.fit(_data["X"], _data["Y"], config["batch_size"], epochs, config["lr"])
+    out = nn.predict_batch(_data["Xval"], chunk_size=65536)
+    error = float(np.mean(np.sum((out - _data["Yval"])**2, axis=1)))
+    # buffers are rebuilt on demand, no need to send them back
+    nn._workspaces = {}
+    return i, nn, error, time.perf_counter() - start
+
+if __name__ == '__main__':
+    from circ_data import DATA
+    X = [p[0] for p in DATA]
+    Y = [p[1] for p in DATA]
+    method = sys.argv[1] if len(sys.argv) > 1 else "grid"
+    print_results(search(X, Y, method=method, seed=0), top=20)
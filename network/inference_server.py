@@ -0,0 +1,199 @@
+"""
+    Local inference server for trained SupervisedNetworks.
+    Clients connect through a Unix socket or localhost TCP and send one
+    JSON list (an input vector) per line. Every answer is the JSON list of
+    outputs, in a line of its own. The line "stats" answers with the
+    server counters instead.
+    Concurrent requests are grouped into micro-batches, each one answered
+    with a single vectorized forward pass.
+"""
+
+import numpy as np
+import asyncio
+import collections
+import json
+import time
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from supervised_network import SupervisedNetwork
+
+class MicroBatcher:
+    """
+        Collects concurrent requests into batches of at most
+        max_batch_size rows, waiting at most max_wait seconds for a batch
+        to fill up.
+    """
+    def __init__(self, nn, max_batch_size=64, max_wait=0.002):
+        self.nn = nn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        # latencies of the last requests, in seconds
+        self.latencies = collections.deque(maxlen=100000)
+        self.served = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    async def predict(self, inp):
+        """ Queues one input vector and waits for its output. """
+        inp = np.asarray(inp, dtype=self.nn.dtype)
+        if inp.shape != (self.nn.numNeurons[0],):
+            raise ValueError("expected a list of " + str(self.nn.numNeurons[0])
+                             + " numbers")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((inp, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        """ Answers batches forever. """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                out = self.nn.predict_batch([inp for inp, _, _ in batch])
+            except Exception as ex:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(ex)
+                continue
+            now = time.perf_counter()
+            for (_, future, start), result in zip(batch, out):
+                if not future.done():
+                    future.set_result(result.tolist())
+                self.latencies.append(now - start)
+            self.served += len(batch)
+            self.batches += 1
+
+    def statistics(self):
+        """
+            All statistics available:
+            served        -> amount of requests answered
+            batches       -> amount of forward passes
+            avg_batch     -> average amount of requests per pass
+            throughput    -> requests answered per second since start
+            p50_ms/p99_ms -> latency percentiles of the last requests
+        """
+        latencies = np.array(self.latencies)*1000
+        statistics = {
+            "served": self.served,
+            "batches": self.batches,
+            "avg_batch": self.served/self.batches if self.batches else 0,
+            "throughput": self.served/(time.perf_counter() - self.started),
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0
+        }
+        return statistics
+
+async def serve(nn, path=None, host="127.0.0.1", port=8765,
+                max_batch_size=64, max_wait=0.002):
+    """
+        Starts serving nn on the Unix socket `path`, or on host:port if
+        path is None.
+        returns: (server, batcher), the asyncio server and its MicroBatcher.
+    """
+    batcher = MicroBatcher(nn, max_batch_size, max_wait)
+    batcher.task = asyncio.ensure_future(batcher.run())
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip() == b"stats":
+                    answer = batcher.statistics()
+                else:
+                    try:
+                        answer = await batcher.predict(json.loads(line))
+                    except (ValueError, TypeError) as ex:
+                        answer = {"error": str(ex)}
+                writer.write(json.dumps(answer).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if path is not None:
+        server = await asyncio.start_unix_server(handle, path)
+    else:
+        server = await asyncio.start_server(handle, host, port)
+    return server, batcher
+
+async def load_test(dimension, requests=20000, concurrency=64, path=None,
+                    host="127.0.0.1", port=8765):
+    """
+        Load generator: `concurrency` clients send `requests` random
+        inputs in total, each one waiting for its answer before sending
+        the next.
+        returns: (float) requests answered per second.
+    """
+    async def client(amount):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        for row in np.random.rand(amount, dimension).tolist():
+            writer.write(json.dumps(row).encode() + b"\n")
+            await writer.drain()
+            await reader.readline()
+        writer.close()
+
+    start = time.perf_counter()
+    share = [requests//concurrency + (i < requests%concurrency)
+             for i in range(concurrency)]
+    await asyncio.gather(*[client(amount) for amount in share])
+    return requests/(time.perf_counter() - start)
+
+async def compare(nn, requests=20000, concurrency=64, max_batch_size=64,
+                  max_wait=0.002, port=8765):
+    """
+        Runs the load generator against a server answering one request at
+        a time and against a micro-batching one, printing throughput and
+        latencies of both.
+    """
+    for batch_size in (1, max_batch_size):
+        server, batcher = await serve(nn, port=port, max_batch_size=batch_size,
+                                      max_wait=max_wait)
+        throughput = await load_test(nn.numNeurons[0], requests, concurrency,
+                                     port=port)
+        stats = batcher.statistics()
+        print(f"max_batch_size={batch_size:<4} {throughput:>10.0f} req/s  "
+              f"avg batch {stats['avg_batch']:>6.1f}  "
+              f"p50 {stats['p50_ms']:.2f}ms  p99 {stats['p99_ms']:.2f}ms")
+        server.close()
+        await server.wait_closed()
+        batcher.task.cancel()
+
+async def _serve_forever(nn, path):
+    server, batcher = await serve(nn, path)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == "serve":
+        nn = SupervisedNetwork.load(sys.argv[2], mmap_mode="r")
+        path = sys.argv[3] if len(sys.argv) > 3 else None
+        asyncio.run(_serve_forever(nn, path))
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        if len(sys.argv) > 2:
+            nn = SupervisedNetwork.load(sys.argv[2], mmap_mode="r")
+        else:
+            nn = SupervisedNetwork([5, 64, 64, 1])
+        asyncio.run(compare(nn))
+    else:
+        print("Usage: python inference_server.py serve <model> [socket path]\n"
+              "       python inference_server.py bench [model]")
@@ -0,0 +1,190 @@
+"""
+    Data-parallel training of SupervisedNetwork.
+    The dataset is split in one contiguous shard per worker process, and
+    weights, biases and the dataset itself live in shared memory.
+
+    mode "sync"    -> every step, each worker calculates the gradient of a
+                      batch of its shard, the gradients are averaged and
+                      applied once. Same as fit() with batches
+                      `workers` times bigger.
+    mode "hogwild" -> every worker runs fit() on its shard, updating the
+                      shared weights in place with no locks at all.
+"""
+
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import time
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from supervised_network import SupervisedNetwork, _param_count, _param_views
+
+def train_parallel(nn, X, Y, workers=2, epochs=1, batch_size=32, lr=0.03,
+                   mode="sync", seed=None):
+    """
+        Trains nn with `workers` processes. nn's weights are updated at the
+        end, as if it had been trained with fit().
+        X (array) -> (N, numNeurons[0]) matrix of inputs.
+        Y (array) -> (N, numNeurons[-1]) matrix of expected outputs.
+        workers (int)    -> amount of worker processes.
+        batch_size (int) -> amount of samples of each worker's steps.
+        mode (str)       -> "sync" or "hogwild".
+        seed (int)       -> seeds the order each worker visits its shard.
+        returns: (list) the average squared error of each epoch.
+    """
+    if mode not in ("sync", "hogwild"):
+        raise nn.SupervisedNetworkError("mode must be 'sync' or 'hogwild'")
+    X = np.asarray(X, dtype=nn.dtype)
+    Y = np.asarray(Y, dtype=nn.dtype).reshape(len(X), -1)
+    if not 1 <= workers <= len(X):
+        raise nn.SupervisedNetworkError("workers must be between 1 and len(X)")
+    bounds = [int(b) for b in np.linspace(0, len(X), workers + 1)]
+    # every worker must take the same amount of steps in sync mode
+    smallest_shard = min(b - a for a, b in zip(bounds, bounds[1:]))
+    steps = max(1, -(-smallest_shard//batch_size))
+    if seed is None:
+        seed = np.random.randint(2**31 - workers)
+
+    shms = []
+    specs = {}
+    def share(key, shape, dtype):
+        size = max(1, int(np.prod(shape))*np.dtype(dtype).itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        shms.append(shm)
+        specs[key] = (shm.name, shape, np.dtype(dtype).str)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    try:
+        params = share("params", (_param_count(nn.numNeurons),), nn.dtype)
+        weights, bias = _param_views(params, nn.numNeurons)
+        for i in range(len(weights)):
+            weights[i][...] = nn.weights[i]
+            bias[i][...] = nn.bias[i]
+        share("X", X.shape, X.dtype)[...] = X
+        share("Y", Y.shape, Y.dtype)[...] = Y
+        errors = share("errors", (workers, epochs), np.float64)
+        if mode == "sync":
+            share("grads", (workers, len(params)), nn.dtype)
+
+        ctx = mp.get_context()
+        barrier = ctx.Barrier(workers)
+        processes = [ctx.Process(target=_worker,
+                                 args=(rank, nn, specs, bounds, steps, epochs,
+                                       batch_size, lr, mode, barrier, seed))
+                     for rank in range(workers)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        if any(p.exitcode != 0 for p in processes):
+            raise nn.SupervisedNetworkError("a training worker failed")
+
+        for i in range(len(weights)):
+            nn.weights[i][...] = weights[i]
+            nn.bias[i][...] = bias[i]
+        history = [float(e) for e in errors.sum(axis=0)/len(X)]
+    finally:
+        params = weights = bias = errors = None
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return history
+
+def benchmark(X, Y, numNeurons, max_workers=None, epochs=5, batch_size=64,
+              lr=0.03, activate="tanh"):
+    """
+        Compares single process fit() with train_parallel() in both modes,
+        going from 1 to max_workers workers.
+        Prints and returns a list of (method, workers, epoch time in
+        seconds, average squared error of the last epoch).
+    """
+    if max_workers is None:
+        max_workers = mp.cpu_count()
+    counts = sorted(set([2**i for i in range(max_workers.bit_length())]
+                        + [max_workers]))
+    base = SupervisedNetwork(numNeurons, activate)
+    nn = base.copy()
+    start = time.perf_counter()
+    history = nn.fit(X, Y, batch_size, epochs, lr)
+    results = [("fit", 1, (time.perf_counter() - start)/epochs, history[-1])]
+    for mode in ("sync", "hogwild"):
+        for workers in counts:
+            nn = base.copy()
+            start = time.perf_counter()
+            history = train_parallel(nn, X, Y, workers, epochs, batch_size,
+                                     lr, mode)
+            results.append((mode, workers,
+                            (time.perf_counter() - start)/epochs, history[-1]))
+    print(f"{'method':>8} {'workers':>8} {'epoch (s)':>10} {'error':>10}")
+    for method, workers, epoch_time, error in results:
+        print(f"{method:>8} {workers:>8} {epoch_time:>10.4f} {error:>10.5f}")
+    return results
+
+# private
+
+def _worker(rank, nn, specs, bounds, steps, epochs, batch_size, lr, mode,
+            barrier, seed):
+    shms = []
+    arrays = {}
+    try:
+        for key, (name, shape, dtype) in specs.items():
+            shm = shared_memory.SharedMemory(name=name)
+            shms.append(shm)
+            arrays[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        _train_shard(rank, nn, arrays, bounds, steps, epochs, batch_size,
+                     lr, mode, barrier, seed)
+    except BaseException:
+        # releases the other workers if they are waiting for this one
+        barrier.abort()
+        raise
+    # views must be gone before the shared memory is closed
+    nn.weights = nn.bias = None
+    arrays.clear()
+    for shm in shms:
+        shm.close()
+
+def _train_shard(rank, nn, arrays, bounds, steps, epochs, batch_size, lr,
+                 mode, barrier, seed):
+    np.random.seed(seed + rank)
+    nn.weights, nn.bias = _param_views(arrays["params"], nn.numNeurons)
+    nn._workspaces = {}
+    X = arrays["X"][bounds[rank]:bounds[rank + 1]]
+    Y = arrays["Y"][bounds[rank]:bounds[rank + 1]]
+    errors = arrays["errors"]
+
+    if mode == "hogwild":
+        for e in range(epochs):
+            errors[rank, e] = nn.fit(X, Y, batch_size, 1, lr)[0]*len(X)
+        return
+
+    params = arrays["params"]
+    grads = arrays["grads"]
+    dw, db = _param_views(grads[rank], nn.numNeurons)
+    mean = np.empty_like(params)
+    workers = len(grads)
+    order = np.arange(len(X))
+    for e in range(epochs):
+        np.random.shuffle(order)
+        error = 0
+        for idx in np.array_split(order, steps):
+            xb, yb = nn._gather(X, Y, idx)
+            error += nn._gradients(xb, yb, lr)
+            ws = nn._workspace(len(idx))
+            for i in range(len(dw)):
+                dw[i][...] = ws.dw[i]
+                db[i][...] = ws.db[i]
+            barrier.wait()
+            if rank == 0:
+                np.sum(grads, axis=0, out=mean)
+                mean /= workers
+                params += mean
+            barrier.wait()
+        errors[rank, e] = error
+
+if __name__ == '__main__':
+    from circ_data import DATA
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    X = np.array([p[0] for p in DATA]*200)
+    Y = np.array([p[1] for p in DATA]*200)
+    benchmark(X, Y, [5, 16, 1], workers)
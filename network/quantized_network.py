@@ -0,0 +1,81 @@
+import numpy as np
+
+class QuantizedNetwork:
+    """
+        Inference-only copy of a SupervisedNetwork.
+        Weights are stored as int8 with one float32 scale per layer,
+        such that weights[i] ~= scales[i] * qweights[i]. Biases and
+        activations are kept in float32.
+    """
+    def __init__(self, network):
+        """
+            Quantizes a trained SupervisedNetwork.
+            network (SupervisedNetwork) -> the network to be exported.
+        """
+        self.numNeurons = list(network.numNeurons)
+        self.activate = network.activate
+        self.activationNames = list(network.activationNames)
+        self.qweights = []
+        self.scales = []
+        self.bias = []
+        for w, b in zip(network.weights, network.bias):
+            scale = float(np.max(np.abs(w)))/127
+            if scale == 0:
+                scale = 1.0
+            self.qweights.append(np.round(w/scale).astype(np.int8))
+            self.scales.append(np.float32(scale))
+            self.bias.append(np.asarray(b, dtype=np.float32))
+
+    def apply(self, inp):
+        """
+            Applies the network to one input vector or to a
+            (N, numNeurons[0]) matrix of inputs, one row per input.
+        """
+        hVals = np.asarray(inp, dtype=np.float32)
+        for i in range(len(self.qweights)):
+            hVals = hVals@self.qweights[i]
+            hVals *= self.scales[i]
+            hVals += self.bias[i]
+            hVals = self.activate[i][0](hVals, out=hVals)
+        return hVals
+
+    def nbytes(self):
+        """ Memory used by the parameters, in bytes. """
+        return sum(w.nbytes + b.nbytes + 4
+                   for w, b in zip(self.qweights, self.bias))
+
+    def compare(self, network, X, Y):
+        """
+            Measures how much accuracy was lost with the quantization.
+            network (SupervisedNetwork) -> the reference network.
+            X (array) -> (N, numNeurons[0]) matrix of inputs.
+            Y (array) -> (N, numNeurons[-1]) matrix of expected outputs.
+            returns: (dict) with the average squared error of both
+                     models, its change, the biggest difference between
+                     their outputs and how often their signs agree.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        Y = np.asarray(Y, dtype=np.float64).reshape(len(X), -1)
+        reference = np.asarray(network.predict_batch(X), dtype=np.float64)
+        quantized = self.apply(X).astype(np.float64)
+        reference_error = float(np.mean(np.sum((reference - Y)**2, axis=1)))
+        quantized_error = float(np.mean(np.sum((quantized - Y)**2, axis=1)))
+        comparison = {
+            "avg_error": reference_error,
+            "quantized_avg_error": quantized_error,
+            "error_change": quantized_error - reference_error,
+            "max_output_diff": float(np.max(np.abs(reference - quantized))),
+            "sign_agreement": float(np.mean(np.sign(reference) == np.sign(quantized))),
+            "reference_nbytes": sum(w.nbytes + b.nbytes for w, b in
+                                    zip(network.weights, network.bias)),
+            "quantized_nbytes": self.nbytes()
+        }
+        return comparison
+
+    def statistics(self):
+        statistics = {
+            "qweights": self.qweights,
+            "scales": self.scales,
+            "biases": self.bias
+        }
+        return statistics
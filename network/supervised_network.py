@@ -1,18 +1,12 @@
 import numpy as np
 import copy
-import random
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-import math
+import json
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from base.base_learning import BaseLearning
 from base.base_activate import Activate as act
-
-epoch = 0
-side = 40
-ratio = 1
+from network.quantized_network import QuantizedNetwork
 
 class SupervisedNetwork(BaseLearning):
     """
@@ -20,37 +14,119 @@ class SupervisedNetwork(BaseLearning):
         Created by:
         IceMage144 (João Gabriel Basi)
     """
-    def __init__(self, numNeurons, activate="tanh"):
+    class SupervisedNetworkError(Exception):
+        """ Common class for errors thrown by SupervisedNetwork. """
+        pass
+
+    def __init__(self, numNeurons, activate="tanh", dtype=np.float64):
+        """
+            Initializes a network with random weights.
+            numNeurons (list) -> amount of neurons in each layer,
+                                 input and output layers included.
+                                 example: [2, 2, 1]
+            activate (str|list) -> activation of every layer, or a list
+                                   with one activation per layer.
+                                   Activations are names registered in
+                                   Activate (e.g. "tanh", "sigmoid",
+                                   "relu", "leaky_relu") or [f, df] pairs
+                                   of functions of one array, where df
+                                   receives the output of f. Pairs of
+                                   a function of Activate are taken as
+                                   its name.
+            dtype (numpy dtype) -> float type used for weights, training
+                                   and inference. np.float32 halves memory
+                                   traffic at the cost of precision.
+        """
         if type(activate) == str:
-            f = getattr(act, activate)
-            df = getattr(act, "d" + activate)
-            self.activate = [[f, df] for i in range(len(numNeurons))]
-        elif type(activate) == list:
-            self.activate = []
-            for e in activate:
-                if type(e) == str:
-                    f = getattr(act, activate)
-                    df = getattr(act, "d" + activate)
-                    self.activate.append([f, df])
-                elif type(e) == list:
-                    self.activate.append(e)
+            activate = [activate for i in range(len(numNeurons) - 1)]
+        self._set_activations(activate)
+        if len(self.activate) < len(numNeurons) - 1:
+            raise self.SupervisedNetworkError("expected one activation per layer")
         self.numNeurons = numNeurons
+        self.dtype = np.dtype(dtype)
         self.weights = []
         self.bias = []
         for i in range(len(numNeurons) - 1):
-            self.weights.append(np.random.rand(numNeurons[i], numNeurons[i+1])*2 - 1)
-            self.bias.append(np.random.rand(numNeurons[i+1])*2 - 1)
+            self.weights.append((np.random.rand(numNeurons[i], numNeurons[i+1])*2 - 1).astype(self.dtype))
+            self.bias.append((np.random.rand(numNeurons[i+1])*2 - 1).astype(self.dtype))
+        # Training buffers, one _Workspace per batch size
+        self._workspaces = {}
+
+    def _set_activations(self, activate):
+        """ Fills self.activate and self.activationNames. """
+        self.activate = []
+        self.activationNames = []
+        for e in activate:
+            if type(e) == str:
+                if e not in act.registry:
+                    raise self.SupervisedNetworkError(
+                        "unknown activation '" + e + "'. Expected one of "
+                        + str(sorted(act.registry)))
+                self.activate.append(list(act.get(e)))
+                self.activationNames.append(e)
+            elif type(e) in (list, tuple):
+                name = self._registered_name(*e)
+                if name is not None:
+                    self.activate.append(list(act.get(name)))
+                    self.activationNames.append(name)
+                    continue
+                # the network passes out= to activations, custom ones
+                # may not take it
+                self.activate.append([_OptionalOut(f) for f in e])
+                self.activationNames.append(None)
+
+    def _registered_name(self, function, derivative):
+        """
+            Name of the activation of Activate that the pair [function,
+            derivative] is, or None if it is a custom one.
+            Derivatives of Activate named d<name> take the input of the
+            function instead of its output, so pairs mixing them up
+            would train on wrong gradients and are refused.
+        """
+        for name, (f, df) in act.registry.items():
+            from_input = getattr(act, 'd' + name, None)
+            if function is f:
+                if derivative is df or derivative is from_input:
+                    return name
+                raise self.SupervisedNetworkError(
+                    "the derivative of Activate." + name + " must be "
+                    "Activate.d" + name + ". Use the name '" + name + "'")
+            if derivative is from_input:
+                raise self.SupervisedNetworkError(
+                    "Activate.d" + name + " takes the input of Activate."
+                    + name + ", custom derivatives take the output of "
+                    "their function")
+        return None
 
     def apply(self, inp):
-        hVals = np.array(inp)
+        """
+            Applies the network to one input vector or to a
+            (N, numNeurons[0]) matrix of inputs, one row per input.
+        """
+        hVals = np.asarray(inp, dtype=self.dtype)
         for i in range(len(self.weights)):
-            hVals = self.activate[i][0](np.dot(hVals, self.weights[i]) + self.bias[i])
+            hVals = self.activate[i][0](hVals@self.weights[i] + self.bias[i])
         return hVals
 
+    def predict_batch(self, X, chunk_size=None):
+        """
+            Applies the network to a (N, numNeurons[0]) matrix of inputs.
+            chunk_size (int) -> if set, feeds at most chunk_size rows at
+                                a time, capping peak memory on big inputs.
+            returns: (N, numNeurons[-1]) matrix of outputs.
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        if chunk_size is None or len(X) <= chunk_size:
+            return self.apply(X)
+        out = np.empty((len(X), self.numNeurons[-1]), dtype=self.dtype)
+        for start in range(0, len(X), chunk_size):
+            out[start:start + chunk_size] = self.apply(X[start:start + chunk_size])
+        return out
+
     def statistics(self, data):
-        error = 0
-        for p in data:
-            error += (self.apply(p[0]) - p[1])**2
+        X = np.array([p[0] for p in data], dtype=float)
+        Y = np.array([p[1] for p in data], dtype=float).reshape(len(X), -1)
+        error = np.sum((self.predict_batch(X) - Y)**2, axis=0)
         statistics = {
             "avg_error": error/len(data),
             "error_sum": error,
@@ -60,99 +136,271 @@ class SupervisedNetwork(BaseLearning):
         return statistics
 
     def train(self, inp, expected, lr=0.03):
+        """
+            Trains the network with a single sample.
+            Same as a fit() step with a batch of size 1.
+        """
+        ws = self._workspace(1)
+        ws.inp[0] = inp
+        ws.target[0] = expected
+        self._train_batch(ws.inp, ws.target, lr)
+
+    def fit(self, X, Y, batch_size=32, epochs=1, lr=0.03, shuffle=True):
+        """
+            Trains the network with mini-batches of samples.
+            X (array) -> (N, numNeurons[0]) matrix of inputs.
+            Y (array) -> (N, numNeurons[-1]) matrix of expected outputs.
+            batch_size (int) -> amount of samples in each gradient step.
+            epochs (int)     -> amount of passes through the whole dataset.
+            shuffle (bool)   -> visits the samples in a new random order
+                                every epoch.
+            returns: (list) the average squared error of each epoch.
+        """
+        X = np.asarray(X, dtype=self.dtype)
+        Y = np.asarray(Y, dtype=self.dtype).reshape(len(X), -1)
+        order = np.arange(len(X))
+        history = []
+        for e in range(epochs):
+            if shuffle:
+                np.random.shuffle(order)
+            error = 0
+            for start in range(0, len(X), batch_size):
+                if shuffle:
+                    xb, yb = self._gather(X, Y, order[start:start + batch_size])
+                else:
+                    xb = X[start:start + batch_size]
+                    yb = Y[start:start + batch_size]
+                error += self._train_batch(xb, yb, lr)
+            history.append(error/len(X))
+        return history
+
+    def _workspace(self, rows):
+        """ Returns the training buffers for batches of `rows` rows. """
+        ws = self._workspaces.get(rows)
+        if ws is None:
+            ws = _Workspace(self.numNeurons, rows, self.dtype)
+            self._workspaces[rows] = ws
+        return ws
+
+    def _gather(self, X, Y, idx):
+        """ Copies the rows idx of X and Y into the preallocated buffers. """
+        ws = self._workspace(len(idx))
+        return (np.take(X, idx, axis=0, out=ws.inp, mode='clip'),
+                np.take(Y, idx, axis=0, out=ws.target, mode='clip'))
+
+    def _train_batch(self, X, Y, lr):
+        """
+            Does one gradient step with the batch (X, Y), updating weights
+            and biases in place.
+            Returns the squared error of the batch before the step.
+        """
+        ws = self._workspace(len(X))
+        sq_error = self._gradients(X, Y, lr)
+        for i in range(len(self.weights)):
+            self.weights[i] += ws.dw[i]
+            self.bias[i] += ws.db[i]
+        return sq_error
+
+    def _gradients(self, X, Y, lr):
+        """
+            Calculates the step of every weight and bias for the batch
+            (X, Y), already scaled by the learning rate, into the dw and db
+            buffers of the batch size. All intermediate values are written
+            into preallocated buffers, so no arrays are allocated after
+            the first step, unless an activation is a custom [f, df]
+            pair, whose results are calculated apart and copied.
+            Returns the squared error of the batch.
+        """
+        ws = self._workspace(len(X))
+        last = len(self.weights) - 1
+
         # Feedforward
-        hVals = np.array(inp)
-        res = [copy.deepcopy(hVals)]
+        hVals = X
         for i in range(len(self.weights)):
-            hVals = np.dot(hVals, self.weights[i]) + self.bias[i]
-            res.append(copy.deepcopy(hVals))
-            hVals = self.activate[i][0](hVals)
+            np.matmul(hVals, self.weights[i], out=ws.res[i])
+            ws.res[i] += self.bias[i]
+            hVals = self.activate[i][0](ws.res[i], out=ws.acts[i])
 
-        # Claculate first error
-        error = (expected - hVals)*self.activate[-1][1](res[-1])
+        # Calculate first error. The derivatives are taken from the
+        # activations of the forward pass, overwriting them once they are
+        # not needed anymore.
+        error = np.subtract(Y, hVals, out=ws.error[last])
+        sq_error = float(np.vdot(error, error))
+        error *= self.activate[last][1](hVals, out=hVals)
+        step = lr/len(X)
 
-        for i in range(len(self.weights) - 1, -1, -1):
+        for i in range(last, -1, -1):
             # Calculate gradients
-            dw = lr*np.outer(self.activate[i][0](res[i]), error)
-            db = lr*error
+            layer_input = X if i == 0 else ws.acts[i - 1]
+            dw = np.matmul(layer_input.T, error, out=ws.dw[i])
+            dw *= step
+            db = np.sum(error, axis=0, out=ws.db[i])
+            db *= step
 
             # Calculate next error
-            error = (self.weights[i]@error)*self.activate[i][1](res[i])
-
-            # Sum gradients
-            self.weights[i] += dw
-            self.bias[i] += db
+            if i > 0:
+                next_error = np.matmul(error, self.weights[i].T, out=ws.error[i - 1])
+                next_error *= self.activate[i - 1][1](layer_input, out=layer_input)
+                error = next_error
+        return sq_error
 
     def copy(self):
         return copy.deepcopy(self)
 
-def xor_test():
-    nn = SupervisedNetwork([2, 2, 1])
-    x = [[[0, 0], [-1]],
-         [[0, 1], [1]],
-         [[1, 0], [1]],
-         [[1, 1], [-1]]]
-    fig, ax = plt.subplots(figsize=(5, 5))
-    mat = [[[ratio*(2*x/side - 1), ratio*(1 - 2*y/side)] for x in range(side)] for y in range(side)]
-    c = ax.imshow([[nn.apply(mat[i][j])[0] for i in range(side)] for j in range(side)],
-                  interpolation='nearest',
-                  aspect='auto',
-                  cmap='RdYlGn')
-    epoch_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
-    def update():
-        global epoch
-        for i in range(100):
-            s = random.sample(x, 1)[0]
-            nn.train(s[0], s[1])
-        epoch += 100
-        yield [[nn.apply(mat[i][j])[0] for i in range(side)] for j in range(side)]
-    def plot(update):
-        global epoch
-        c.set_data(update)
-        epoch_text.set_text(f"Epoch = {epoch}")
-        return c, epoch_text
-    ani = FuncAnimation(fig, plot, update, interval=50)
-    plt.ylim(0, side)
-    plt.xlim(0, side)
-    plt.show()
-    print(nn.weights)
-    print(nn.bias)
-    p = input("Point: ")
-    while p != "":
-        p = [float(i) for i in p.split()]
-        print(p)
-        print(nn.apply(p))
-        p = input("Point: ")
+    def save(self, path):
+        """
+            Saves the network into a binary checkpoint at `path`: a small
+            JSON header with layer sizes, activation names and dtype,
+            followed by every weight and bias, stored as
+            [W0, b0, W1, b1, ...] at an aligned offset.
+            Only networks with registered activations can be saved.
+        """
+        layers = len(self.numNeurons) - 1
+        names = self.activationNames[:layers]
+        if None in names:
+            raise self.SupervisedNetworkError("only networks with registered "
+                                              "activations can be saved")
+        header = json.dumps({
+            "numNeurons": [int(n) for n in self.numNeurons],
+            "activations": names,
+            "dtype": self.dtype.str
+        }).encode()
+        offset = -(-(len(_CHECKPOINT_MAGIC) + 4 + len(header))
+                   //_CHECKPOINT_ALIGN)*_CHECKPOINT_ALIGN
+        with open(path, "wb") as f:
+            f.write(_CHECKPOINT_MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            f.write(bytes(offset - f.tell()))
+            for i in range(layers):
+                np.ascontiguousarray(self.weights[i], dtype=self.dtype).tofile(f)
+                np.ascontiguousarray(self.bias[i], dtype=self.dtype).tofile(f)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """
+            Loads a network saved with save().
+            mmap_mode (str) -> if set, weights and biases are views of a
+                               memory map of the file instead of being
+                               read, so processes loading the same file
+                               share its pages. Same modes as np.memmap:
+                               "r" (read-only, inference only), "c"
+                               (copy-on-write) or "r+" (writes go to the
+                               file).
+        """
+        with open(path, "rb") as f:
+            if f.read(len(_CHECKPOINT_MAGIC)) != _CHECKPOINT_MAGIC:
+                raise cls.SupervisedNetworkError(str(path) + " is not a "
+                                                 "SupervisedNetwork checkpoint")
+            length = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(length).decode())
+            offset = -(-(len(_CHECKPOINT_MAGIC) + 4 + length)
+                       //_CHECKPOINT_ALIGN)*_CHECKPOINT_ALIGN
+            numNeurons = header["numNeurons"]
+            dtype = np.dtype(header["dtype"])
+            count = _param_count(numNeurons)
+            if mmap_mode is None:
+                f.seek(offset)
+                flat = np.fromfile(f, dtype=dtype, count=count)
+                if len(flat) != count:
+                    raise cls.SupervisedNetworkError(str(path) + " is truncated")
+        if mmap_mode is not None:
+            flat = np.memmap(path, dtype=dtype, mode=mmap_mode, offset=offset,
+                             shape=(count,))
+        # skips __init__, there is no need for random weights
+        nn = cls.__new__(cls)
+        nn._set_activations(header["activations"])
+        nn.numNeurons = numNeurons
+        nn.dtype = dtype
+        nn.weights, nn.bias = _param_views(flat, numNeurons)
+        nn._workspaces = {}
+        return nn
+
+    def quantize(self):
+        """
+            Exports a compact, inference-only copy of the network, with
+            int8 weights and one scale per layer.
+            See QuantizedNetwork.compare() to measure the accuracy change.
+        """
+        return QuantizedNetwork(self)
 
+_CHECKPOINT_MAGIC = b"SNET\x00\x01"
+_CHECKPOINT_ALIGN = 64
 
-def test(case):
+def _param_count(numNeurons):
+    """ Amount of weights and biases of a network. """
+    return sum(numNeurons[i]*numNeurons[i+1] + numNeurons[i+1]
+               for i in range(len(numNeurons) - 1))
+
+def _param_views(flat, numNeurons):
+    """
+        Splits a flat array into weights and biases views, stored as
+        [W0, b0, W1, b1, ...].
+    """
+    weights = []
+    bias = []
+    offset = 0
+    for i in range(len(numNeurons) - 1):
+        n, m = numNeurons[i], numNeurons[i+1]
+        weights.append(flat[offset:offset + n*m].reshape(n, m))
+        offset += n*m
+        bias.append(flat[offset:offset + m])
+        offset += m
+    return weights, bias
+
+class _OptionalOut:
+    """
+        Custom activation f(x), called like the ones of Activate, with
+        an optional out array that receives the result.
+    """
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, x, out=None):
+        y = self.function(x)
+        if out is None:
+            return y
+        out[...] = y
+        return out
+
+class _Workspace:
+    """
+        Buffers used by SupervisedNetwork training steps with batches of
+        a fixed amount of rows. Lists are indexed by layer.
+    """
+    def __init__(self, numNeurons, rows, dtype):
+        self.inp = np.empty((rows, numNeurons[0]), dtype=dtype)
+        self.target = np.empty((rows, numNeurons[-1]), dtype=dtype)
+        # pre-activations, activations and errors
+        self.res = [np.empty((rows, n), dtype=dtype) for n in numNeurons[1:]]
+        self.acts = [np.empty((rows, n), dtype=dtype) for n in numNeurons[1:]]
+        self.error = [np.empty((rows, n), dtype=dtype) for n in numNeurons[1:]]
+        # gradients
+        self.dw = [np.empty((numNeurons[i], numNeurons[i+1]), dtype=dtype)
+                   for i in range(len(numNeurons) - 1)]
+        self.db = [np.empty(n, dtype=dtype) for n in numNeurons[1:]]
+
+def xor_test(side=40):
+    from visualizer import LiveVisualizer
+    nn = SupervisedNetwork([2, 2, 1])
+    X = [[0, 0], [0, 1], [1, 0], [1, 1]]
+    Y = [[-1], [1], [1], [-1]]
+    LiveVisualizer(nn, X, Y, side=side).show()
+    _ask_points(nn)
+
+def test(case, side=40):
+    from visualizer import LiveVisualizer, quadratic_features
     if case == "circ":
         from circ_data import DATA
     elif case == "quad":
         from quad_data import DATA
     nn = SupervisedNetwork([5, 2, 1])
-    fig, ax = plt.subplots(figsize=(5, 5))
-    mat = [[[ratio*(2*x/side - 1), ratio*(1 - 2*y/side), (ratio*(2*x/side - 1))**2, (ratio*(1 - 2*y/side))**2, ratio*(1 - 2*y/side)*ratio*(2*x/side - 1)] for x in range(side)] for y in range(side)]
-    c = ax.imshow([[nn.apply(mat[i][j])[0] for i in range(side)] for j in range(side)],
-                  interpolation='nearest',
-                  aspect='auto',
-                  cmap='RdYlGn')
-    epoch_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
-    def update():
-        global epoch
-        for i in range(50):
-            nn.train(DATA[epoch%len(DATA)][0], DATA[epoch%len(DATA)][1])
-            epoch += 1
-        yield [[nn.apply(mat[i][j])[0] for i in range(side)] for j in range(side)]
-    def plot(update):
-        global epoch
-        c.set_data(update)
-        epoch_text.set_text(f"Epoch = {epoch}")
-        return c, epoch_text
-    ani = FuncAnimation(fig, plot, update, interval=50)
-    plt.ylim(0, side)
-    plt.xlim(0, side)
-    plt.show()
+    X = [p[0] for p in DATA]
+    Y = [p[1] for p in DATA]
+    LiveVisualizer(nn, X, Y, features=quadratic_features, side=side).show()
+    _ask_points(nn)
+
+def _ask_points(nn):
     print(nn.weights)
     print(nn.bias)
     p = input("Point: ")
@@ -163,9 +411,10 @@ def test(case):
         p = input("Point: ")
 
 if __name__ == '__main__':
+    side = int(sys.argv[2]) if len(sys.argv) > 2 else 40
     if len(sys.argv) == 1 or sys.argv[1] == "xor":
-        xor_test()
+        xor_test(side)
     elif sys.argv[1] == "quad":
-        test("quad")
+        test("quad", side)
     elif sys.argv[1] == "circ":
-        test("circ")
+        test("circ", side)
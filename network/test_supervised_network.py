@@ -0,0 +1,46 @@
+import tracemalloc
+import numpy as np
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from base.base_activate import Activate
+from network.supervised_network import SupervisedNetwork
+
+def _step_peak(activate, batch=512):
+    """
+        Peak of memory traced by a training step, after warm-up, of a
+        network with activation `activate` and batches of `batch` rows.
+    """
+    np.random.seed(0)
+    nn = SupervisedNetwork([64, 256, 256, 1], activate)
+    X = np.random.randn(batch, 64)
+    Y = np.random.randn(batch, 1)
+    # the first step allocates the buffers of the batch size
+    nn._train_batch(X, Y, 0.01)
+    # scratch buffers of numpy ufuncs are not arrays, but are traced.
+    # Shrunk, they stay far below the smallest array of a batch
+    bufsize = np.setbufsize(16)
+    try:
+        tracemalloc.start()
+        nn._train_batch(X, Y, 0.01)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    finally:
+        np.setbufsize(bufsize)
+    return peak
+
+def test_no_allocations_after_warm_up():
+    # the (batch, 1) output is the smallest array a step could allocate
+    smallest = 512*1*np.dtype(np.float64).itemsize
+    for name in sorted(Activate.registry):
+        peak = _step_peak(name)
+        assert peak < smallest, (name, peak)
+
+def test_fit_reduces_error():
+    np.random.seed(0)
+    X = np.random.randn(256, 2)
+    Y = np.tanh(X[:, 0]*X[:, 1])
+    for name in sorted(Activate.registry):
+        nn = SupervisedNetwork([2, 8, 1], name)
+        history = nn.fit(X, Y, batch_size=32, epochs=20, lr=0.05)
+        assert history[-1] < history[0], name
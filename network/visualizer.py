@@ -0,0 +1,172 @@
+"""
+    Live visualization of a SupervisedNetwork while it trains.
+    Training runs in a background process, as fast as headless training,
+    and publishes a snapshot of the weights at a fixed rate through shared
+    memory. The figure only evaluates the latest snapshot, over the whole
+    grid in a single batched call, and redraws with blitting.
+"""
+
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import copy
+import time
+import sys
+import os
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from supervised_network import _param_count, _param_views
+
+def plane_features(points):
+    """ Uses the (x, y) coordinates as they are. """
+    return points
+
+def quadratic_features(points):
+    """ Maps (x, y) to (x, y, x^2, y^2, xy). """
+    x = points[:, 0]
+    y = points[:, 1]
+    return np.column_stack((x, y, x**2, y**2, x*y))
+
+def grid_points(side, ratio=1):
+    """
+        Returns the (side*side, 2) coordinates of a square grid over
+        [-ratio, ratio]^2, row by row.
+    """
+    xs = ratio*(2*np.arange(side)/side - 1)
+    ys = ratio*(1 - 2*np.arange(side)/side)
+    gx, gy = np.meshgrid(xs, ys)
+    return np.column_stack((gx.ravel(), gy.ravel()))
+
+def grid_values(nn, inputs, side):
+    """
+        Evaluates the network on the inputs of a grid in a single batched
+        call. Returns its first output as a (side, side) image.
+    """
+    return nn.predict_batch(inputs)[:, 0].reshape(side, side).T
+
+class LiveVisualizer:
+    """
+        Shows the first output of a network over a square grid while it
+        trains on (X, Y).
+    """
+    def __init__(self, nn, X, Y, features=plane_features, side=40, ratio=1,
+                 batch_size=1, lr=0.03, interval=50, snapshot_rate=20):
+        """
+            nn (SupervisedNetwork) -> the network, trained in place.
+            features (function)   -> maps (n, 2) grid coordinates into
+                                     (n, numNeurons[0]) network inputs.
+            side (int)            -> resolution of the grid.
+            interval (int)        -> milliseconds between redraws.
+            snapshot_rate (float) -> weight snapshots per second.
+        """
+        self.nn = nn
+        self.X = np.asarray(X, dtype=nn.dtype)
+        self.Y = np.asarray(Y, dtype=nn.dtype).reshape(len(self.X), -1)
+        self.side = side
+        self.inputs = np.ascontiguousarray(features(grid_points(side, ratio)),
+                                           dtype=nn.dtype)
+        self.batch_size = batch_size
+        self.lr = lr
+        self.interval = interval
+        self.snapshot_rate = snapshot_rate
+
+    def show(self):
+        """
+            Trains while the figure is open. When it is closed, training
+            stops and nn keeps the last weights trained.
+            returns: (int) the amount of epochs trained.
+        """
+        nn = self.nn
+        count = _param_count(nn.numNeurons)
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=count*nn.dtype.itemsize)
+        try:
+            shared = np.ndarray((count,), dtype=nn.dtype, buffer=shm.buf)
+            weights, bias = _param_views(shared, nn.numNeurons)
+            for i in range(len(weights)):
+                weights[i][...] = nn.weights[i]
+                bias[i][...] = nn.bias[i]
+
+            ctx = mp.get_context()
+            lock = ctx.Lock()
+            epochs = ctx.Value("l", 0, lock=False)
+            stop = ctx.Event()
+            trainer = ctx.Process(target=_train,
+                                  args=(nn, self.X, self.Y, self.batch_size,
+                                        self.lr, shm.name, lock, epochs, stop,
+                                        1/self.snapshot_rate),
+                                  daemon=True)
+            trainer.start()
+            try:
+                self._animate(shared, lock, epochs)
+            finally:
+                stop.set()
+                trainer.join()
+            for i in range(len(weights)):
+                nn.weights[i][...] = weights[i]
+                nn.bias[i][...] = bias[i]
+            trained = epochs.value
+        finally:
+            shared = weights = bias = None
+            shm.close()
+            shm.unlink()
+        return trained
+
+    def _animate(self, shared, lock, epochs):
+        """ Runs the figure until it is closed. """
+        # network reading a private copy of the latest snapshot
+        snapshot = np.array(shared)
+        view = copy.copy(self.nn)
+        view.weights, view.bias = _param_views(snapshot, self.nn.numNeurons)
+        view._workspaces = {}
+
+        fig, ax = plt.subplots(figsize=(5, 5))
+        image = ax.imshow(grid_values(view, self.inputs, self.side),
+                          interpolation='nearest',
+                          aspect='auto',
+                          cmap='RdYlGn',
+                          animated=True)
+        epoch_text = ax.text(0.05, 0.9, '', transform=ax.transAxes,
+                             animated=True)
+
+        def update(frame):
+            with lock:
+                snapshot[...] = shared
+                epoch = epochs.value
+            image.set_data(grid_values(view, self.inputs, self.side))
+            epoch_text.set_text(f"Epoch = {epoch}")
+            return image, epoch_text
+
+        ani = FuncAnimation(fig, update, interval=self.interval, blit=True,
+                            cache_frame_data=False)
+        plt.ylim(0, self.side)
+        plt.xlim(0, self.side)
+        plt.show()
+
+def _train(nn, X, Y, batch_size, lr, shm_name, lock, epochs, stop,
+           snapshot_interval):
+    """ Training process: fits epoch after epoch until `stop` is set. """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    shared = np.ndarray((_param_count(nn.numNeurons),), dtype=nn.dtype,
+                        buffer=shm.buf)
+    weights, bias = _param_views(shared, nn.numNeurons)
+    def publish():
+        with lock:
+            for i in range(len(weights)):
+                weights[i][...] = nn.weights[i]
+                bias[i][...] = nn.bias[i]
+            epochs.value = trained
+
+    trained = 0
+    last = time.perf_counter()
+    while not stop.is_set():
+        nn.fit(X, Y, batch_size, 1, lr)
+        trained += 1
+        now = time.perf_counter()
+        if now - last >= snapshot_interval:
+            last = now
+            publish()
+    publish()
+    shared = weights = bias = None
+    shm.close()
@@ -0,0 +1,41 @@
+import sys
+import os
+# Adds higher directory to python modules path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import time
+import numpy as np
+from perceptron import Perceptron
+from pocket import PerceptronWithPocket
+
+def random_dataset(size, dimensions, noise=0.1, seed=0):
+    """
+        Points labeled by a random hyperplane, with a fraction `noise`
+        of the labels flipped so that the set is not separable.
+    """
+    random = np.random.RandomState(seed)
+    data = random.randn(size, dimensions)
+    plane = random.randn(dimensions + 1)
+    results = plane[0] + data.dot(plane[1:]) >= 0
+    flip = random.rand(size) < noise
+    results[flip] = ~results[flip]
+    return data, results
+
+def time_rounds(model, rounds):
+    """ Returns the average time of a training round of model, in seconds. """
+    start = time.perf_counter()
+    ran = model.train(rounds)
+    return (time.perf_counter() - start)/ran
+
+def benchmark(sizes=(1000, 10000, 100000), dimensions=(3, 100), rounds=200):
+    """ Prints the cost of a training round for each dataset shape. """
+    print(f"{'model':>22} {'points':>8} {'dims':>5} {'ms/round':>9}")
+    for size in sizes:
+        for dims in dimensions:
+            data, results = random_dataset(size, dims)
+            for model in (Perceptron, PerceptronWithPocket):
+                per_round = time_rounds(model(data, results, seed=0), rounds)
+                print(f"{model.__name__:>22} {size:>8} {dims:>5} "
+                      f"{per_round*1000:>9.3f}")
+
+if __name__ == '__main__':
+    benchmark()
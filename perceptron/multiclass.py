@@ -0,0 +1,221 @@
+import sys
+import os
+# Adds higher directory to python modules path.
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import math
+import numpy as np
+from perceptron import Perceptron
+from sparse import SparseRows
+
+class MulticlassPerceptron(Perceptron):
+    """
+        One-vs-rest multi-class perceptron.
+        Keeps one perceptron per class, as the rows of a single
+        (K, d+1) weight matrix: row k tells class k from the rest.
+        Every round scores all points in all classes with one matrix
+        product, and a point is predicted as the class of highest score.
+    """
+
+    def __init__(self, data, results, weights=None, seed=None):
+        """
+            Initializes a multi-class perceptron instance.
+            Uses the same parameters in Perceptron but averaged, except:
+            results (list|tuple|array) -> the class of each point, of any
+                                          sortable type.
+                                          example: ['cat', 'dog', 'cat']
+            weights (list)             -> (K, d+1) matrix, one row per
+                                          class, in sorted order.
+        """
+        X, points = self._build_X(data, results)
+        self.classes, labels = np.unique(np.asarray(results),
+                                         return_inverse=True)
+        self._setup(X, labels, weights, seed)
+        if self.sparse:
+            self.data = points
+
+    def train(self, rounds=10000):
+        """
+            Trains with data for `rounds` amount of rounds.
+            (if every class is fully fit before `rounds` rounds, it stops).
+            Every round picks at random a point some class gets wrong,
+            and adjusts only the rows of the classes that got it wrong.
+            Returns: (int) the number of rounds that actually ran.
+        """
+        for round_number in range(rounds):
+            wrong = self._wrong_classes(self._scores(self.X, self.weights))
+            index = self._pick(wrong.any(axis=1))
+            if index is None:
+                # every class is fully fit
+                return round_number + 1
+            self._adjust(index, wrong[index])
+        return rounds
+
+    def apply(self, datapoint):
+        """
+            Applies the classifier to new datapoint.
+            datapoint (list|tuple|array) -> one point of n dimensions
+                                            (the same n we trained in).
+            returns:
+                the predicted class.
+        """
+        if type(datapoint) not in (list, tuple, np.ndarray):
+            raise self.PerceptronError('datapoint is not a list, a tuple '
+                                       'or an array')
+        if len(datapoint) != self.dimensions - 1:
+            raise self.PerceptronError('datapoint does not have the correct'
+                                       'dimension. Expected', self.dimensions - 1)
+        return self._apply_many([datapoint], self._function())[0]
+
+    def apply_many(self, points):
+        """
+            Applies the classifier to many datapoints at once, with a
+            single matrix product.
+            points (array) -> (N, n) matrix, one point per row.
+            returns:
+                (array) the N predicted classes.
+        """
+        return self._apply_many(points, self._function())
+
+    def statistics(self):
+        """
+            All statistics available:
+            percentage_hits -> percentage of correct predictions
+                               in initial input data
+            classes         -> the classes, in the order of the rows
+                               of weights
+            weights         -> the final (K, d+1) weight matrix.
+        """
+        weights = self._function()
+        hits = self._hits(weights)
+        statistics = {
+            'percentage_hits': round(hits*100/len(self.X), 2),
+            'classes': self.classes.tolist(),
+            'weights': weights.tolist()
+        }
+        return statistics
+
+    # private, heritable
+
+    def _setup(self, X, labels, weights, seed, averaged=False):
+        """
+            Sets the model around X and labels, the index in
+            self.classes of the class of each point.
+        """
+        self.dimensions = X.shape[1]
+        self.X = X
+        self.sparse = isinstance(X, SparseRows)
+        if not self.sparse:
+            self.data = self.X[:, 1:]
+        self.labels = labels
+        # results[i, k] tells if point i is of class k
+        self.results = labels[:, None] == np.arange(len(self.classes))
+        self.random = np.random.RandomState(seed)
+        shape = (len(self.classes), self.dimensions)
+        if weights is not None:
+            if np.shape(weights) != shape:
+                raise self.PerceptronError('Weights do not have the correct '
+                                           'shape. expected ' + str(shape))
+            self.weights = np.array(weights, dtype=float)
+        else:
+            self.weights = self.random.rand(*shape) * 10
+        self.averaged = False
+        self.updates = 0
+
+    def _scores(self, X, weights):
+        """ (N, K) scores of every point of X in every class. """
+        return X.dot(weights.T)
+
+    def _wrong_classes(self, scores):
+        """ Mask of the (point, class) pairs each row gets wrong. """
+        return (scores >= 0) != self.results
+
+    def _hits_from(self, scores):
+        """ How many points get the highest score in their class. """
+        return int(np.count_nonzero(scores.argmax(axis=1) == self.labels))
+
+    def _hits(self, weights):
+        """ Returns how many points `weights` gets right. """
+        return self._hits_from(self._scores(self.X, weights))
+
+    def _adjust(self, index, wrong):
+        """
+            adjusts the rows of the classes in the mask `wrong` with
+            point X[index], like w <- w + xi * yi in each of them.
+        """
+        rows = np.flatnonzero(wrong)
+        signs = np.where(rows == self.labels[index], 1.0, -1.0)
+        if self.sparse:
+            # only the non-zero columns of xi change
+            columns, values = self.X.row(index)
+            self.weights[np.ix_(rows, columns)] += signs[:, None]*values
+        else:
+            self.weights[rows] += signs[:, None]*self.X[index]
+        self.updates += 1
+
+    def _apply_many(self, points, weights):
+        """ apply_many() with the given weights. """
+        scores = self._check_points(points).dot(weights[:, 1:].T)
+        scores += weights[:, 0]
+        return self.classes[scores.argmax(axis=1)]
+
+class MulticlassPerceptronWithPocket(MulticlassPerceptron):
+    """
+        Multi-class perceptron with pocket: keeps the weight matrix
+        that classified most points right while training, and uses it
+        instead of the last one.
+    """
+
+    def __init__(self, data, results, weights=None, seed=None):
+        """ Uses the same parameters in MulticlassPerceptron. """
+        super().__init__(data, results, weights, seed)
+        self.pocket = self.weights.copy()
+        # hits of the pocket, measured when first needed
+        self.pocket_hits = None
+
+    def train(self, rounds=10000):
+        """
+            Trains with data for `rounds` amount of rounds.
+            Every round, checks if the weight matrix created is better
+            than the one in the pocket. If so, swaps the one in the
+            pocket for it.
+            Returns: (int) the number of rounds that actually ran.
+        """
+        for round_number in range(rounds):
+            # the product that finds the wrong classes also scores
+            # the matrix created in the last round
+            scores = self._scores(self.X, self.weights)
+            self._compare_pocket(self._hits_from(scores))
+            wrong = self._wrong_classes(scores)
+            index = self._pick(wrong.any(axis=1))
+            if index is None:
+                return round_number + 1
+            self._adjust(index, wrong[index])
+        # scores the matrix created in the last round
+        self._compare_pocket(self._hits(self.weights))
+        return rounds
+
+    # private, heritable
+
+    def _function(self):
+        """ The pocket is what the model applies. """
+        return self.pocket
+
+    def _compare_pocket(self, hits):
+        """
+            Replaces the pocket with the weights if they have more
+            `hits` than it.
+        """
+        if self.pocket_hits is None:
+            self.pocket_hits = self._hits(self.pocket)
+        if hits > self.pocket_hits:
+            self.pocket = self.weights.copy()
+            self.pocket_hits = hits
+
+if __name__ == '__main__':
+    from data import INPUT
+
+    # three classes: the third of [0, 4pi] where x + y falls
+    results = [min(2, int((x + y)*3/(4*math.pi))) for x, y, z in INPUT]
+    p = MulticlassPerceptronWithPocket(INPUT, results)
+    amount_rounds = p.train(3000)
+    print(p.statistics()['percentage_hits'], 'rounds trained =', amount_rounds)
@@ -2,8 +2,10 @@ import sys
 import os
 # Adds higher directory to python modules path.
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-import random
+import itertools
+import numpy as np
 from base.base_learning import BaseLearning
+from sparse import SparseRows
 
 class Perceptron(BaseLearning):
     """
@@ -15,129 +17,274 @@ class Perceptron(BaseLearning):
         """ Common class for errors thrown by perceptron. """
         pass
 
-    def __init__(self, data, results, weights=None):
+    def __init__(self, data, results, weights=None, seed=None, averaged=False):
         """
             Initializes a perceptron algorithm instance.
-            data (list|tuple)    -> list containing points in nth-dimension.
-                                    example: [(0.3, 0.5, 3), (4.3, 4.9, 1)]
-            results (list|tuple) -> list of booleans containing the answers
-                                    for the data.
-                                    example: [True, True, False]
-            weights (list)       -> initializes weights as set, instead of
-                                    random numbers.
+            data (list|tuple|array) -> list containing points in nth-dimension.
+                                       example: [(0.3, 0.5, 3), (4.3, 4.9, 1)]
+                                       May also be sparse, as SparseRows or
+                                       a scipy.sparse.csr_matrix: training
+                                       then only touches non-zero values.
+            results (list|tuple)    -> list of booleans containing the answers
+                                       for the data.
+                                       example: [True, True, False]
+            weights (list)          -> initializes weights as set, instead of
+                                       random numbers.
+            seed (int)              -> seeds the initial weights and the
+                                       choice of points while training, so
+                                       that training is reproducible.
+            averaged (bool)         -> if set, the model applied is the
+                                       average of the weights of every
+                                       training round (averaged perceptron),
+                                       which generalizes better when data
+                                       is not separable.
             constraint: len(data) == len(results)
             constraint: len(data[0]) == len(data[1]) == len(data[2])...
             constraint: len(data[0]) + 1 == len(weights)
         """
-        if type(data) not in (list, tuple):
-            raise PerceptronError('data must be a list or a tuple')
-        if len(data) < 1:
-            raise PerceptronError('data must not be empty')
-        if len(data) != len(results):
-            raise PerceptronError('data and results must be of equal length')
-
-        self.data = list(data)
-        # For now a constant
-        self.shuffle_amount = 500
-        self.results = list(results)
-        self.dimensions = len(data[0]) + 1
-        for i in data:
-            if len(i) != self.dimensions - 1:
-                raise PerceptronError('data is not consistent in dimensions')
-        if weights:
-            if len(weights) != self.dimensions:
-                raise PerceptronError('Weights do not have the correct '
-                                      'dimension. expected'
-                                      + str(self.dimensions))
-            self.weights = weights
-        else:
-            self.weights = [random.random() * 10 for i in range(self.dimensions)]
+        X, points = self._build_X(data, results)
+        self._setup(X, np.array(results, dtype=bool), weights, seed, averaged)
+        if self.sparse:
+            self.data = points
 
     def train(self, rounds=10000):
         """
             Trains with data for `rounds` amount of rounds.
             (if it is fully fit before `rounds` rounds, it stops).
+            Every round finds all misclassified points with a single
+            matrix-vector product, and adjusts with one of them
+            chosen at random.
             Returns: (int) the number of rounds that actually ran.
         """
         for round_number in range(rounds):
-            # shuffle its own data
-            # so that it doesn't stay in the same numbers
-            self._shuffle()
-            for datapoint, answer in zip(self.data, self.results):
-                signal = self._apply_function(datapoint) >= 0
-                if signal != answer:
-                    self._adjust(datapoint, answer)
-                    # Adjusted once, go to next round
-                    break
-            else:
+            index = self._pick(self._wrong(self.weights))
+            if index is None:
                 # no incorrect answer was found: dataset
                 # is fully fit with current weights
+                self._update_average()
                 return round_number + 1
+            # Adjusted once, go to next round
+            self._adjust(index)
+        self._update_average()
         return rounds
 
     def apply(self, datapoint):
         """
             Applies perceptron to new datapoint.
-            datapoint (list) -> one point of n dimensions
-                                (the same n we trained in).
+            datapoint (list|tuple|array) -> one point of n dimensions
+                                            (the same n we trained in).
             returns:
                 prediction (-1 or 1)
         """
-        if type(datapoint) not in (list, tuple):
-            raise PerceptronError('datapoint is not a list or a tuple')
+        if type(datapoint) not in (list, tuple, np.ndarray):
+            raise self.PerceptronError('datapoint is not a list, a tuple '
+                                       'or an array')
         if len(datapoint) != self.dimensions - 1:
-            raise PerceptronError('datapoint does not have the correct'
-                                  'dimension. Expected', self.dimensions - 1)
+            raise self.PerceptronError('datapoint does not have the correct'
+                                       'dimension. Expected', self.dimensions - 1)
         s = self._apply_function(datapoint)
         return 1 if s >= 0 else -1
 
+    def apply_many(self, points):
+        """
+            Applies perceptron to many datapoints at once, with a single
+            matrix-vector product.
+            points (array) -> (N, n) matrix, one point per row.
+            returns:
+                (array) the N predictions (-1 or 1), as int8.
+        """
+        return self._apply_many(points, self._function())
+
+    def apply_stream(self, source, chunk_size=65536, delimiter=None):
+        """
+            Applies perceptron to a stream of datapoints, chunk_size of
+            them at a time, so memory does not grow with the stream.
+            source -> an iterable of points, or the path of a file:
+                      either a .npy file of an (N, n) matrix, which is
+                      memory mapped, or a text file with one point per
+                      line.
+            delimiter (str) -> separator of the numbers in a text file.
+                               Whitespace by default.
+            returns:
+                generator of arrays, the predictions of each chunk as
+                returned by apply_many.
+        """
+        return self._stream(source, chunk_size, delimiter, self._function())
+
     def statistics(self):
         """
             All statistics available:
             percentage_hits -> percentage of correct predictions
                                in initial input data
             weights         -> the final weights calculated in
-                               perceptron algorithm.
+                               perceptron algorithm (averaged, if
+                               the perceptron is).
         """
-        all_data = len(self.data)
-        hits = 0
-        for data, result in zip(self.data, self.results):
-            signal = self._apply_function(data) >= 0
-            if signal == result:
-                hits += 1
-
+        weights = self._function()
+        hits = self._hits(weights)
         statistics = {
-            'percentage_hits': round(hits*100/all_data, 2),
-            'weights': self.weights
+            'percentage_hits': round(hits*100/len(self.X), 2),
+            'weights': weights.tolist()
         }
         return statistics
 
     # private, heritable
 
+    def _build_X(self, data, results):
+        """
+            Checks data and builds X from it.
+            returns: (X, points) where points is data as an array
+                     or SparseRows.
+        """
+        if hasattr(data, 'indptr') and not isinstance(data, SparseRows):
+            data = SparseRows.from_csr(data)
+        if type(data) not in (list, tuple, np.ndarray, SparseRows):
+            raise self.PerceptronError('data must be a list, a tuple, '
+                                       'an array or sparse')
+        if len(data) < 1:
+            raise self.PerceptronError('data must not be empty')
+        if len(data) != len(results):
+            raise self.PerceptronError('data and results must be of equal length')
+        if isinstance(data, SparseRows):
+            return data.with_bias(), data
+
+        # X holds one point per row, with a first column of ones
+        # for the threshold: X[i] = (1, x1, x2, ..., xn)
+        try:
+            points = np.asarray(data, dtype=float)
+        except ValueError:
+            raise self.PerceptronError('data is not consistent in dimensions')
+        if points.ndim != 2:
+            raise self.PerceptronError('data is not consistent in dimensions')
+        X = np.empty((len(points), points.shape[1] + 1))
+        X[:, 0] = 1
+        X[:, 1:] = points
+        return X, points
+
+    def _setup(self, X, results, weights, seed, averaged=False):
+        """
+            Sets the model around X, the (N, d+1) matrix of points with
+            the threshold column already built (an array or SparseRows),
+            and the boolean array results. Neither is copied.
+        """
+        self.dimensions = X.shape[1]
+        self.X = X
+        self.sparse = isinstance(X, SparseRows)
+        if not self.sparse:
+            self.data = self.X[:, 1:]
+        self.results = results
+        self.random = np.random.RandomState(seed)
+        if weights is not None:
+            if len(weights) != self.dimensions:
+                raise self.PerceptronError('Weights do not have the correct '
+                                           'dimension. expected'
+                                           + str(self.dimensions))
+            self.weights = np.array(weights, dtype=float)
+        else:
+            self.weights = self.random.rand(self.dimensions) * 10
+        # Averaging is lazy: after t updates u_t, the average of the
+        # weights is w - sum((i - 1)*u_i)/t, so only the sum has to be
+        # kept, and updating it touches the same columns as the update.
+        self.averaged = averaged
+        self.updates = 0
+        if averaged:
+            self.average = self.weights.copy()
+            self.weighted_updates = np.zeros(self.dimensions)
+
+    def _function(self):
+        """ The weights applied by the model. """
+        return self.average if self.averaged else self.weights
+
+    def _update_average(self):
+        """ Brings the average up to date with the updates done. """
+        if self.averaged and self.updates:
+            np.divide(self.weighted_updates, -self.updates, out=self.average)
+            self.average += self.weights
+
     def _apply_function(self, datapoint):
         """ applies sum(wi * xi) """
-        s = self.weights[0] # 1 * w[0]
-        for wi, xi in zip(self.weights[1:], datapoint):
-            s += wi * xi
-        return s
+        weights = self._function()
+        return weights[0] + np.dot(weights[1:], datapoint)
+
+    def _apply_many(self, points, weights):
+        """ apply_many() with the given weights. """
+        scores = self._check_points(points).dot(weights[1:])
+        scores += weights[0]
+        return np.where(scores >= 0, np.int8(1), np.int8(-1))
+
+    def _check_points(self, points):
+        """ Returns points as an (N, n) array or SparseRows. """
+        if hasattr(points, 'indptr') and not isinstance(points, SparseRows):
+            points = SparseRows.from_csr(points)
+        if not isinstance(points, SparseRows):
+            try:
+                points = np.asarray(points, dtype=float)
+            except ValueError:
+                raise self.PerceptronError('points are not consistent in dimensions')
+        if len(points.shape) != 2 or points.shape[1] != self.dimensions - 1:
+            raise self.PerceptronError('points must be a matrix with one point '
+                                       'of dimension ' + str(self.dimensions - 1)
+                                       + ' per row')
+        return points
 
-    def _adjust(self, datapoint, answer):
-        """ adjusts datapoint like w <- w + xi * yi """
+    def _stream(self, source, chunk_size, delimiter, weights):
+        """ apply_stream() with the given weights. """
+        if isinstance(source, str) and source.endswith('.npy'):
+            points = np.load(source, mmap_mode='r')
+            for begin in range(0, len(points), chunk_size):
+                yield self._apply_many(points[begin:begin + chunk_size], weights)
+            return
+        if isinstance(source, str):
+            with open(source) as f:
+                while True:
+                    lines = list(itertools.islice(f, chunk_size))
+                    if not lines:
+                        return
+                    yield self._apply_many(np.loadtxt(lines, delimiter=delimiter,
+                                                      ndmin=2), weights)
+        rows = iter(source)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield self._apply_many(chunk, weights)
+
+    def _wrong(self, weights):
+        """ Returns a mask of the points `weights` gets wrong. """
+        return (self.X.dot(weights) >= 0) != self.results
+
+    def _hits(self, weights):
+        """ Returns how many points `weights` gets right. """
+        return len(self.X) - int(np.count_nonzero(self._wrong(weights)))
+
+    def _adjust(self, index):
+        """ adjusts point X[index] like w <- w + xi * yi """
+        if self.sparse:
+            # only the non-zero columns of xi change
+            columns, values = self.X.row(index)
+        else:
+            columns, values = slice(None), self.X[index]
         # w += xi * yi
-        adjust = 1 if answer else -1
-        self.weights[0] += adjust * 1 # treshold
-        for i in range(1, len(self.weights)):
-            self.weights[i] += datapoint[i - 1] * adjust
-
-    def _shuffle(self):
-        """ Shuffles internal dataset """
-        # shuffles self.shuffle times
-        for i in range(self.shuffle_amount):
-            # finds two and swap
-            a = random.randint(0, len(self.data) - 1)
-            b = random.randint(0, len(self.data) - 1)
-            self.data[a], self.data[b] = self.data[b], self.data[a]
-            self.results[a], self.results[b] = self.results[b], self.results[a]
+        if self.results[index]:
+            self.weights[columns] += values
+        else:
+            self.weights[columns] -= values
+        if self.averaged:
+            if self.results[index]:
+                self.weighted_updates[columns] += self.updates*values
+            else:
+                self.weighted_updates[columns] -= self.updates*values
+        self.updates += 1
+
+    def _pick(self, wrong):
+        """
+            Picks one of the points of the mask `wrong` at random,
+            without touching the dataset. Returns None if there is none.
+        """
+        indexes = np.flatnonzero(wrong)
+        if len(indexes) == 0:
+            return None
+        return indexes[self.random.randint(len(indexes))]
 
 if __name__ == '__main__':
     from data import INPUT, RESULTS
@@ -2,8 +2,12 @@ import sys
 import os
 # Adds higher directory to python modules path.
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-import random
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
 from perceptron import Perceptron
+from sparse import SparseRows
 
 class PerceptronWithPocket(Perceptron):
     """
@@ -16,13 +20,22 @@ class PerceptronWithPocket(Perceptron):
         ~razgrizone (Pedro Pereira)
     """
 
-    def __init__(self, data, results, weights=None):
+    def __init__(self, data, results, weights=None, seed=None,
+                 validation_size=None):
         """
             Initializes a Pocket algorithm instance.
-            Uses the same parameters in Perceptron.
+            Uses the same parameters in Perceptron but averaged, and:
+            validation_size (int) -> if set, candidates are compared with
+                                     the pocket only on a fixed random
+                                     sample of this many points, and
+                                     misclassified points are searched
+                                     chunk by chunk, so a round costs the
+                                     same no matter how big the dataset is.
+                                     By default (exact mode) the whole
+                                     dataset is used.
         """
-        super().__init__(data, results, weights)
-        self.pocket = list(self.weights)
+        super().__init__(data, results, weights, seed)
+        self._setup_pocket(validation_size)
 
     def train(self, rounds=10000):
         """
@@ -32,40 +45,54 @@ class PerceptronWithPocket(Perceptron):
             If so, swaps the one in the pocket for it.
             Returns: (int) the number of rounds that actually ran.
         """
+        if self.validation is not None:
+            return self._train_sampled(rounds)
         for round_number in range(rounds):
-            # shuffle its own data
-            # so that it doesn't stay in the same numbers
-            # self._shuffle()
-            for datapoint, answer in zip(self.data, self.results):
-                signal = self._apply_function(datapoint) >= 0
-                if signal != answer:
-                    self._adjust(datapoint, answer)
-                    # Adjusted once: check if weights are better than
-                    # the pocket function
-                    self._compare_pocket()
-                    break
-            else:
+            # the pass that finds the misclassified points also
+            # scores the function created in the last round
+            wrong = self._wrong(self.weights)
+            self._compare_pocket(len(self.X) - int(np.count_nonzero(wrong)))
+            index = self._pick(wrong)
+            if index is None:
                 # no incorrect answer was found: dataset
                 # is fully fit with current weights
                 return round_number + 1
+            self._adjust(index)
+        # scores the function created in the last round
+        self._compare_pocket()
         return rounds
 
     def apply(self, datapoint):
         """
             Applies the pocket function to the datapoint.
-            datapoint (list) -> one point of n dimensions
-                                (the same n we trained in).
+            datapoint (list|tuple|array) -> one point of n dimensions
+                                            (the same n we trained in).
             returns:
                 prediction (-1 or 1)
         """
-        if type(datapoint) not in (list, tuple):
-            raise PerceptronError('datapoint is not a list or a tuple')
+        if type(datapoint) not in (list, tuple, np.ndarray):
+            raise self.PerceptronError('datapoint is not a list, a tuple '
+                                       'or an array')
         if len(datapoint) != self.dimensions - 1:
-            raise PerceptronError('datapoint does not have the correct'
-                                  'dimension. Expected', self.dimensions - 1)
+            raise self.PerceptronError('datapoint does not have the correct'
+                                       'dimension. Expected', self.dimensions - 1)
         s = self._apply_pocket(datapoint)
         return 1 if s >= 0 else -1
 
+    def apply_many(self, points):
+        """
+            Applies the pocket function to many datapoints at once.
+            Same as Perceptron.apply_many.
+        """
+        return self._apply_many(points, self.pocket)
+
+    def apply_stream(self, source, chunk_size=65536, delimiter=None):
+        """
+            Applies the pocket function to a stream of datapoints.
+            Same as Perceptron.apply_stream.
+        """
+        return self._stream(source, chunk_size, delimiter, self.pocket)
+
     def statistics(self):
         """
             All statistics available:
@@ -74,43 +101,181 @@ class PerceptronWithPocket(Perceptron):
             weights         -> the final weights in the pocket.
         """
         # The only change is to apply pocket instead
-        all_data = len(self.data)
-        hits = 0
-        for data, result in zip(self.data, self.results):
-            signal = self._apply_pocket(data) >= 0
-            if signal == result:
-                hits += 1
-
+        hits = self._hits(self.pocket)
         statistics = {
-            'percentage_hits': round(hits*100/all_data, 2),
-            'weights': self.pocket
+            'percentage_hits': round(hits*100/len(self.X), 2),
+            'weights': self.pocket.tolist()
         }
         return statistics
 
+    def train_parallel(self, restarts=8, workers=None, rounds=10000, seed=None):
+        """
+            Trains `restarts` independent runs, each one from its own
+            random weights, in a pool of `workers` processes, and keeps
+            the best pocket of them all. The dataset is put in shared
+            memory once and read by every run, never copied to them.
+            Runs are seeded from `seed`, so the result is reproducible
+            no matter how many workers there are.
+            Returns: (dict)
+                percentage_hits -> percentage of correct predictions of
+                                   the best pocket in the whole dataset
+                seed            -> seed of the run that found it
+                hits            -> percentage_hits of every run
+                seeds           -> seed of every run
+                rounds          -> rounds that actually ran in every run
+                min, max, mean, std -> spread of hits across runs
+        """
+        if restarts < 1:
+            raise self.PerceptronError('restarts must be at least 1')
+        seeds = np.random.RandomState(seed).randint(2**31, size=restarts).tolist()
+        validation_size = None
+        if self.validation is not None:
+            validation_size = len(self.validation)
+
+        if self.sparse:
+            arrays = (self.X.data, self.X.indices, self.X.indptr, self.results)
+        else:
+            arrays = (self.X, self.results)
+        shms = []
+        specs = []
+        try:
+            for array in arrays:
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(1, array.nbytes))
+                shms.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype,
+                           buffer=shm.buf)[...] = array
+                specs.append((shm.name, array.shape, array.dtype.str))
+            with mp.Pool(workers, initializer=_attach_dataset,
+                         initargs=(specs, self.X.shape)) as pool:
+                runs = pool.map(_train_restart,
+                                [(type(self), s, rounds, validation_size)
+                                 for s in seeds])
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+        hits = np.array([run_hits for run_hits, _, _ in runs])
+        best = int(np.argmax(hits))
+        self.pocket = runs[best][1]
+        self.weights = self.pocket.copy()
+        # scored again by _compare_pocket if training goes on
+        self.pocket_hits = None
+        percentage = np.round(hits*100/len(self.X), 2)
+        spread = {
+            'percentage_hits': float(percentage[best]),
+            'seed': seeds[best],
+            'hits': percentage.tolist(),
+            'seeds': seeds,
+            'rounds': [run_rounds for _, _, run_rounds in runs],
+            'min': float(percentage.min()),
+            'max': float(percentage.max()),
+            'mean': round(float(percentage.mean()), 2),
+            'std': round(float(percentage.std()), 2)
+        }
+        return spread
+
     # private, heritable
 
-    def _compare_pocket(self):
+    def _setup_pocket(self, validation_size):
+        """ Sets the pocket and the validation sample, after _setup(). """
+        self.pocket = self.weights.copy()
+        # hits of the pocket, measured when first needed
+        self.pocket_hits = None
+        self.validation = None
+        if validation_size is not None and validation_size < len(self.X):
+            self.validation = np.sort(self.random.choice(len(self.X),
+                                                         validation_size,
+                                                         replace=False))
+            self.validation_X = self.X[self.validation]
+            self.validation_results = self.results[self.validation]
+
+    def _train_sampled(self, rounds):
+        """ train() for when validation_size is set. """
+        for round_number in range(rounds):
+            index = self._find_wrong(self.weights)
+            if index is None:
+                # dataset is fully fit with current weights
+                self.pocket = self.weights.copy()
+                self.pocket_hits = len(self.validation)
+                return round_number + 1
+            self._adjust(index)
+            self._compare_pocket()
+        return rounds
+
+    def _compare_pocket(self, hits=None):
         """
             Compares if the new function 'weights' is better than
             the pocket function. if so, replaces it.
+            hits (int) -> hits of 'weights', if already known.
+            The hits of the pocket are cached, so only 'weights'
+            is evaluated.
         """
-        pocket_hits = 0
-        weights_hits = 0
-        for datapoint, answer in zip(self.data, self.results):
-            signal_weights = self._apply_function(datapoint) >= 0
-            signal_pocket = self._apply_pocket(datapoint) >= 0
-            pocket_hits += int(signal_pocket == answer)
-            weights_hits += int(signal_weights == answer)
-        if weights_hits > pocket_hits:
+        if hits is None:
+            hits = self._score(self.weights)
+        if self.pocket_hits is None:
+            self.pocket_hits = self._score(self.pocket)
+        if hits > self.pocket_hits:
             # new function is better than pocket
-            self.pocket = list(self.weights)
+            self.pocket = self.weights.copy()
+            self.pocket_hits = hits
+
+    def _score(self, weights):
+        """
+            Hits of `weights` in the validation sample, or in the
+            whole dataset if there is none.
+        """
+        if self.validation is None:
+            return self._hits(weights)
+        wrong = (self.validation_X.dot(weights) >= 0) != self.validation_results
+        return len(self.validation) - int(np.count_nonzero(wrong))
+
+    def _find_wrong(self, weights, chunk=1024):
+        """
+            Scans the dataset chunk by chunk, starting from a random
+            point, and returns a random misclassified point of the first
+            chunk that has one. Returns None if there is none.
+        """
+        n = len(self.X)
+        start = self.random.randint(n)
+        for begin in itertools.chain(range(start, n, chunk),
+                                     range(0, start, chunk)):
+            end = min(begin + chunk, n if begin >= start else start)
+            wrong = (self.X[begin:end].dot(weights) >= 0) != self.results[begin:end]
+            index = self._pick(wrong)
+            if index is not None:
+                return begin + index
+        return None
 
     def _apply_pocket(self, datapoint):
         """ applies sum(pi * xi) """
-        s = self.pocket[0] # 1 * w[0]
-        for wi, xi in zip(self.pocket[1:], datapoint):
-            s += wi * xi
-        return s
+        return self.pocket[0] + np.dot(self.pocket[1:], datapoint)
+
+# Dataset of each worker process of train_parallel, in shared memory
+_shared = dict()
+
+def _attach_dataset(specs, shape):
+    arrays = []
+    for name, array_shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        _shared.setdefault("shms", []).append(shm)
+        arrays.append(np.ndarray(array_shape, dtype=dtype, buffer=shm.buf))
+    _shared["results"] = arrays.pop()
+    if len(arrays) == 1:
+        _shared["X"] = arrays[0]
+    else:
+        # data, indices and indptr of a sparse X
+        _shared["X"] = SparseRows(*arrays, shape)
+
+def _train_restart(task):
+    """ One run of train_parallel(): returns (hits, pocket, rounds). """
+    cls, seed, rounds, validation_size = task
+    model = cls.__new__(cls)
+    model._setup(_shared["X"], _shared["results"], None, seed)
+    model._setup_pocket(validation_size)
+    ran = model.train(rounds)
+    return model._hits(model.pocket), model.pocket, ran
 
 if __name__ == '__main__':
     from data import INPUT, RESULTS
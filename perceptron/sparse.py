@@ -0,0 +1,129 @@
+import numpy as np
+
+class SparseRows:
+    """
+        Rows of a sparse matrix in CSR format: the non-zero values of
+        row i are data[indptr[i]:indptr[i + 1]], in the columns
+        indices[indptr[i]:indptr[i + 1]]. Memory grows with the amount
+        of non-zero values, not with the amount of columns.
+        The columns of a row must not repeat.
+        Same layout as scipy.sparse.csr_matrix, see from_csr.
+    """
+    def __init__(self, data, indices, indptr, shape):
+        """
+            data (array)    -> non-zero values, row after row.
+            indices (array) -> column of each value.
+            indptr (array)  -> len(shape[0]) + 1 offsets of the rows.
+            shape (tuple)   -> (rows, columns) of the matrix.
+        """
+        self.data = np.asarray(data, dtype=float)
+        self.indices = np.asarray(indices, dtype=np.intp)
+        self.indptr = np.asarray(indptr, dtype=np.intp)
+        self.shape = (int(shape[0]), int(shape[1]))
+        if len(self.indptr) != self.shape[0] + 1:
+            raise ValueError('indptr must have one offset per row, plus one')
+        if len(self.data) != len(self.indices) or self.indptr[-1] != len(self.data):
+            raise ValueError('data, indices and indptr do not match')
+        # row of each value, built on the first dot()
+        self._rows = None
+
+    @classmethod
+    def from_dicts(cls, rows, columns=None):
+        """
+            Builds the matrix from an iterable of {column: value} dicts,
+            one per row. columns defaults to the biggest column + 1.
+        """
+        indptr = [0]
+        indices = []
+        data = []
+        for row in rows:
+            indices.extend(row.keys())
+            data.extend(row.values())
+            indptr.append(len(indices))
+        if columns is None:
+            columns = max(indices) + 1 if indices else 0
+        return cls(data, indices, indptr, (len(indptr) - 1, columns))
+
+    @classmethod
+    def from_csr(cls, matrix):
+        """
+            Builds the matrix from anything with the attributes of a
+            scipy.sparse.csr_matrix. Its arrays are not copied unless
+            it has repeated columns in a row.
+        """
+        if not getattr(matrix, 'has_canonical_format', True):
+            matrix = matrix.copy()
+            matrix.sum_duplicates()
+        return cls(matrix.data, matrix.indices, matrix.indptr, matrix.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nnz(self):
+        """ Amount of non-zero values. """
+        return len(self.data)
+
+    def __getitem__(self, rows):
+        """
+            A contiguous slice of rows, which shares data and indices,
+            or the rows of an array of row numbers, which are copied.
+        """
+        if isinstance(rows, slice):
+            begin, end, step = rows.indices(len(self))
+            if step != 1:
+                raise ValueError('slices of rows must be contiguous')
+            end = max(begin, end)
+            first, last = self.indptr[begin], self.indptr[end]
+            return SparseRows(self.data[first:last], self.indices[first:last],
+                              self.indptr[begin:end + 1] - first,
+                              (end - begin, self.shape[1]))
+        rows = np.asarray(rows, dtype=np.intp)
+        counts = self.indptr[rows + 1] - self.indptr[rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.intp)
+        np.cumsum(counts, out=indptr[1:])
+        # position of every value taken, in the original arrays
+        positions = (np.repeat(self.indptr[rows] - indptr[:-1], counts)
+                     + np.arange(indptr[-1]))
+        return SparseRows(self.data[positions], self.indices[positions],
+                          indptr, (len(rows), self.shape[1]))
+
+    def row(self, i):
+        """ Returns (columns, values) of the non-zero values of row i. """
+        first, last = self.indptr[i], self.indptr[i + 1]
+        return self.indices[first:last], self.data[first:last]
+
+    def dot(self, weights):
+        """
+            Matrix-vector product, or matrix product if weights is a
+            (columns, K) matrix, touching only the non-zero values.
+        """
+        if weights.ndim == 2:
+            out = np.zeros((len(self), weights.shape[1]))
+            filled = self.indptr[1:] > self.indptr[:-1]
+            if len(self.data):
+                out[filled] = np.add.reduceat(self.data[:, None]*weights[self.indices],
+                                              self.indptr[:-1][filled], axis=0)
+            return out
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return np.bincount(self._rows, weights=self.data*weights[self.indices],
+                           minlength=len(self))
+
+    def with_bias(self):
+        """
+            Returns a copy with a new first column of ones, and every
+            other column moved one to the right.
+        """
+        n = len(self)
+        indptr = self.indptr + np.arange(n + 1)
+        first = indptr[:-1]
+        rest = np.ones(len(self.data) + n, dtype=bool)
+        rest[first] = False
+        data = np.empty(len(rest))
+        data[first] = 1
+        data[rest] = self.data
+        indices = np.empty(len(rest), dtype=np.intp)
+        indices[first] = 0
+        indices[rest] = self.indices + 1
+        return SparseRows(data, indices, indptr, (n, self.shape[1] + 1))
@@ -1,2 +1,2 @@
 #!/bin/bash
-env python network/supervised_network.py "$1"
+env python network/supervised_network.py "$@"
@@ -1,10 +1,21 @@
-import random as r
-random = r.SystemRandom()
+import numpy as np
+import multiprocessing as mp
+# Adds higher directory to python modules path.
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from base.base_pool import bounded_imap
 
 class SimpleMarkovChain:
     """
         Simple Markov chain with words.
         Only previews next word based on last word seen.
+        Words are interned to integer ids (their index in the sorted
+        object array self.words, so that one long word does not widen
+        all others), and the transitions of each word are kept in
+        CSR arrays: the words that follow word i are
+        next_ids[indptr[i]:indptr[i + 1]], and cumulative[...] is the
+        running sum of the times each of them follows word i.
         Created by:
         ~razgrizone (Pedro Pereira)
     """
@@ -13,33 +24,67 @@ class SimpleMarkovChain:
         """ Common class for errors thrown by MarkovChain. """
         pass
 
-    def __init__(self, text):
-        self.chain = dict()
-        self.splitted_text = text.split(' ')
-
-        if '_total' in self.splitted_text:
-            raise MarkovChainException('\'_total\' is a reserved word. Please'
-                                       'do not include it in the text.')
-
-        for idx, word in enumerate(self.splitted_text):
-            if self.chain.get(word) is None:
-                self.chain[word] = dict()
-                self.chain[word]['_total'] = 1
-            else:
-                # is is the last word?
-                self.chain[word]['_total'] += 1
-
-            if idx < len(self.splitted_text) - 1:
-                # sees next word and updates
-                next_word = self.splitted_text[idx + 1]
-                if self.chain[word].get(next_word) is None:
-                    self.chain[word][next_word] = 1
-                else:
-                    self.chain[word][next_word] += 1
+    def __init__(self, text, seed=None):
+        """
+            text (str) -> the text, words separated by spaces.
+            seed (int) -> seeds the random choices of build_chain() and
+                          generate_many(), so that they are reproducible.
+        """
+        self._set_chain(_count_words(text.split(' ')), seed)
+
+    @classmethod
+    def from_files(cls, paths, chunk_size=1 << 22, workers=None, seed=None):
+        """
+            Builds the chain of text files, reading chunk_size characters
+            at a time, so that memory grows with the vocabulary and not
+            with the files. Words are separated by any whitespace, line
+            breaks included. Each file is a text of its own: the last
+            word of a file is not followed by the first of the next.
+            paths (list)  -> paths of the files, or a single path.
+            workers (int) -> if set, chunks are counted in a pool of this
+                             many processes, and their counts merged here.
+            seed (int)    -> as in __init__.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        return cls._build([_read_file(path, chunk_size) for path in paths],
+                          workers, seed)
+
+    @classmethod
+    def from_chunks(cls, chunks, workers=None, seed=None):
+        """
+            Builds the chain of a text given in pieces, as from_files().
+            chunks (iterable) -> consecutive pieces of the text. Words may
+                                 be cut between two of them.
+        """
+        return cls._build([chunks], workers, seed)
+
+    @property
+    def counts(self):
+        """ Times each transition was seen, from the cumulative sums. """
+        counts = self.cumulative.copy()
+        counts[1:] -= self.cumulative[:-1]
+        # the first transition of each word starts a new sum
+        starts = self.indptr[:-1][np.diff(self.indptr) > 0]
+        counts[starts] = self.cumulative[starts]
+        return counts
 
     def statistics(self):
+        """
+            All statistics available:
+            chain -> dict view of the chain, built on each call:
+                     {word: {'_total': times word appears,
+                             next word: times it follows word, ...}}
+        """
+        chain = dict()
+        next_words = self.words[self.next_ids].tolist()
+        counts = self.counts.tolist()
+        for i, word in enumerate(self.words.tolist()):
+            begin, end = self.indptr[i], self.indptr[i + 1]
+            chain[word] = {'_total': int(self.totals[i])}
+            chain[word].update(zip(next_words[begin:end], counts[begin:end]))
         statistics = {
-            'chain': self.chain
+            'chain': chain
         }
         return statistics
 
@@ -57,46 +102,307 @@ class SimpleMarkovChain:
                                          infinite loop
         """
         if type(length) is not int:
-            raise MarkovChainException('length is not of type int')
+            raise self.MarkovChainException('length is not of type int')
 
         if type(until_period) is not bool:
-            raise MarkovChainException('until_period is not of type bool')
+            raise self.MarkovChainException('until_period is not of type bool')
 
         if starting_word is None:
-            # Finds any word in the splitted text
-            starting_word = random.choice(self.splitted_text)
-        # starting word exists in text?
-        elif self.chain.get(starting_word) is None:
-                raise MarkovChainException('Starting word doesn\'t'
-                                           'exist in text')
+            # Finds any word in the text, as often as it appears
+            cur_word = int(self._random_words(1)[0]) # current word
+        else:
+            cur_word = self._word_id(starting_word)
+            # starting word exists in text?
+            if cur_word is None:
+                raise self.MarkovChainException('Starting word doesn\'t'
+                                                'exist in text')
         words = list()
-        cur_word = starting_word # current word
         for i in range(length):
             cur_word = self.__insert_word_find_next(words, cur_word)
 
         if until_period:
-            while cur_word[-1] != '.':
+            while not self.words[cur_word].endswith('.'):
                 cur_word = self.__insert_word_find_next(words, cur_word)
-        return ' '.join(words + [cur_word])
+        return ' '.join(self.words[words + [cur_word]].tolist())
+
+    def generate_many(self, n, length, starting_words=None, as_text=True):
+        """
+            Builds n markov sentences of length words at once. All of
+            them walk the chain together: every step draws the random
+            numbers of all sentences in bulk, and finds their next words
+            with a vectorized binary search.
+            arguments:
+
+            n (int)                -> the amount of sentences.
+            length (int)           -> the amount of words of each one.
+            starting_words=None (list) -> The n words to start the
+                                          sentences with. Random words of
+                                          the text by default.
+            as_text=True (bool)    -> if False, returns the (n, length)
+                                      array of word ids instead, which are
+                                      indexes of self.words.
+            returns: (list) the n sentences.
+        """
+        if type(n) is not int or type(length) is not int:
+            raise self.MarkovChainException('n and length must be of type int')
+        if starting_words is None:
+            current = self._random_words(n)
+        else:
+            if len(starting_words) != n:
+                raise self.MarkovChainException('there must be n starting words')
+            current = np.empty(n, dtype=np.int64)
+            for i, word in enumerate(starting_words):
+                word_id = self._word_id(word)
+                if word_id is None:
+                    raise self.MarkovChainException('Starting word doesn\'t'
+                                                    'exist in text')
+                current[i] = word_id
+        sentences = np.empty((n, length), dtype=np.int32)
+        for step in range(length):
+            sentences[:, step] = current
+            current = self._next_words(current, self.random.random_sample(n))
+        if not as_text:
+            return sentences
+        words = self.words[sentences]
+        return [' '.join(sentence) for sentence in words.tolist()]
 
     # private
 
+    @classmethod
+    def _build(cls, texts, workers, seed):
+        """
+            Builds the chain of texts, each one an iterable of chunks.
+            The counts of every piece of text are merged into a running
+            table a few pieces at a time, and the transitions between
+            the last word of a piece and the first of the next one are
+            added apart.
+        """
+        tasks = ((number, piece) for number, text in enumerate(texts)
+                 for piece in _pieces(text))
+        pool = mp.Pool(workers) if workers is not None else None
+        table = None
+        tables = []
+        boundaries = []
+        # text and last word of the last piece with words
+        last = (None, None)
+        try:
+            # a few pieces ahead, so that the text is not read whole
+            counted = (bounded_imap(pool, _count_piece, tasks, 2*workers)
+                       if pool else map(_count_piece, tasks))
+            for number, counts, first, end in counted:
+                if counts is None:
+                    # a piece of only whitespace
+                    continue
+                if last[0] == number:
+                    boundaries.append((last[1], first))
+                last = (number, end)
+                tables.append(counts)
+                if len(tables) >= 16:
+                    table = _merge_tables(tables if table is None else tables + [table])
+                    tables = []
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+        if boundaries:
+            tables.append(_count_pairs(boundaries))
+        if tables:
+            table = _merge_tables(tables if table is None else tables + [table])
+        if table is None:
+            raise cls.MarkovChainException('text is empty')
+        chain = cls.__new__(cls)
+        chain._set_chain(table, seed)
+        return chain
+
+    def _set_chain(self, table, seed):
+        """ Sets the chain to a table of _count_words(). """
+        words, totals, sources, targets, counts = table
+        if np.any(words == '_total'):
+            raise self.MarkovChainException('\'_total\' is a reserved word. Please'
+                                            'do not include it in the text.')
+        self.random = np.random.RandomState(seed)
+        self.words = words
+        # times each word appears in the text
+        self.totals = totals
+        self._set_transitions(sources, targets, counts)
+
+    def _set_transitions(self, sources, targets, counts):
+        """
+            Builds the CSR arrays from the (source, target) pairs of
+            word ids, sorted and without repetitions, seen counts times.
+        """
+        self.indptr = np.zeros(len(self.words) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(self.words)),
+                  out=self.indptr[1:])
+        self.next_ids = targets.astype(np.int32)
+        # running sum of the counts, restarting at every word
+        running = np.cumsum(counts)
+        before = np.concatenate(([0], running))[self.indptr[:-1]]
+        running -= np.repeat(before, np.diff(self.indptr))
+        # no sum is bigger than the amount of words in the text
+        dtype = np.int32 if running.size == 0 or running.max() < 2**31 else np.int64
+        self.cumulative = running.astype(dtype)
+
+    def _random_words(self, n):
+        """ n random word ids, each as likely as it is frequent. """
+        if not hasattr(self, '_occurrences'):
+            self._occurrences = np.cumsum(self.totals)
+        draws = self.random.randint(self._occurrences[-1], size=n)
+        return np.searchsorted(self._occurrences, draws, side='right')
+
+    def _next_words(self, current, uniforms):
+        """
+            Next word ids of the word ids current, given uniform random
+            numbers in [0, 1). Each walker draws a number in [0, sum of
+            the counts of its word), and takes the first transition whose
+            cumulative count is bigger, by binary search. The searches
+            of all walkers are done in one searchsorted over the running
+            sum of all counts, with the draws sorted so that it goes
+            through that array in order. Words followed by no other
+            (the last one of the text) stay where they are.
+        """
+        if len(self.next_ids) == 0:
+            # a text of a single word
+            return current.copy()
+        if not hasattr(self, '_running'):
+            sizes = np.diff(self.indptr)
+            has_next = sizes > 0
+            # sum of the counts of each word, and of all words before it
+            self._sums = np.zeros(len(self.words), dtype=np.int64)
+            self._sums[has_next] = self.cumulative[self.indptr[1:][has_next] - 1]
+            self._before = np.zeros(len(self.words), dtype=np.int64)
+            np.cumsum(self._sums[:-1], out=self._before[1:])
+            self._running = self.cumulative.astype(np.int64)
+            self._running += np.repeat(self._before, sizes)
+        sums = self._sums[current]
+        draws = (uniforms*sums).astype(np.int64)
+        draws += self._before[current]
+        order = np.argsort(draws)
+        positions = np.searchsorted(self._running, draws[order], side='right')
+        result = np.empty_like(current)
+        result[order] = self.next_ids[np.minimum(positions, len(self.next_ids) - 1)]
+        ended = sums == 0
+        result[ended] = current[ended]
+        return result
+
+    def _word_id(self, word):
+        """ Id of word, or None if it is not in the text. """
+        i = np.searchsorted(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            return int(i)
+        return None
+
     def __insert_word_find_next(self, words, current_word):
         words.append(current_word)
-        total = self.chain[current_word]['_total']
-        # finds next word
-        random_int = random.randint(0, total)
-        j = 0
-        for next_word, freq in self.chain[current_word].items():
-            # do not include _total
-            if next_word == '_total': continue
-            if j + freq >= random_int:
-                current_word = next_word
-                break
-            else:
-                j += freq
-
-        return  current_word
+        begin, end = self.indptr[current_word], self.indptr[current_word + 1]
+        if begin == end:
+            # last word of the text, followed by no other
+            return current_word
+        # finds next word: the first one whose cumulative count is bigger
+        # than a random number in [0, sum of the counts)
+        random_int = self.random.randint(self.cumulative[end - 1])
+        return int(self.next_ids[begin + np.searchsorted(self.cumulative[begin:end],
+                                                         random_int, side='right')])
+
+
+# counting words, in the pool processes too
+
+def _intern(tokens):
+    """
+        (words, ids): the sorted distinct tokens, as an object array,
+        and the index in words of each token. Tokens are interned by
+        dicts, so only the distinct ones are sorted.
+    """
+    words = _object_array(sorted(dict.fromkeys(tokens)))
+    return words, _ids(words, tokens)
+
+def _object_array(words):
+    """ The list words as an object array, whatever their lengths. """
+    array = np.empty(len(words), dtype=object)
+    array[:] = words
+    return array
+
+def _ids(words, tokens):
+    """ Index in the sorted array words of each token. """
+    index = dict(zip(words.tolist(), range(len(words))))
+    return np.fromiter(map(index.__getitem__, tokens), dtype=np.int64,
+                       count=len(tokens))
+
+def _count_words(tokens):
+    """
+        Count table of a list of words: (words, totals, sources,
+        targets, counts), with words the sorted distinct words, totals
+        the times each one appears, and each (word, next word) pair
+        seen given by the ids in sources and targets, sorted and
+        without repetitions, with the times it was seen in counts.
+    """
+    words, ids = _intern(tokens)
+    totals = np.bincount(ids, minlength=len(words))
+    # every (word, next word) pair as a single integer, so that
+    # counting pairs is counting integers
+    pairs, counts = np.unique(ids[:-1]*len(words) + ids[1:],
+                              return_counts=True)
+    return words, totals, pairs // len(words), pairs % len(words), counts
+
+def _count_pairs(pairs):
+    """ Count table of (word, next word) pairs, with no totals. """
+    words, ids = _intern([word for pair in pairs for word in pair])
+    ids = ids.reshape(-1, 2)
+    keys, counts = np.unique(ids[:, 0]*len(words) + ids[:, 1],
+                             return_counts=True)
+    return (words, np.zeros(len(words), dtype=np.int64),
+            keys // len(words), keys % len(words), counts)
+
+def _merge_tables(tables):
+    """ Merges count tables of _count_words(), summing their counts. """
+    words = _object_array(sorted(set().union(*[table[0].tolist()
+                                               for table in tables])))
+    totals = np.zeros(len(words), dtype=np.int64)
+    keys = []
+    for table_words, table_totals, sources, targets, counts in tables:
+        ids = _ids(words, table_words.tolist())
+        totals[ids] += table_totals
+        keys.append(ids[sources]*len(words) + ids[targets])
+    keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), minlength=len(keys),
+                         weights=np.concatenate([table[4] for table in tables]))
+    counts = counts.astype(np.int64)
+    return words, totals, keys // len(words), keys % len(words), counts
+
+def _count_piece(task):
+    """ (text number, count table, first word, last word) of a piece. """
+    number, piece = task
+    tokens = piece.split()
+    if not tokens:
+        return number, None, None, None
+    return number, _count_words(tokens), tokens[0], tokens[-1]
+
+def _read_file(path, chunk_size):
+    """ Chunks of chunk_size characters of a text file. """
+    with open(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def _pieces(chunks):
+    """
+        Regroups chunks of a text into pieces that end at a whitespace,
+        so that no word is cut between two pieces.
+    """
+    carry = ''
+    for chunk in chunks:
+        chunk = carry + chunk
+        # end of the last whole word of the chunk
+        cut = max(chunk.rfind(c) for c in ' \n\t\r\f\v')
+        if cut < 0:
+            carry = chunk
+            continue
+        carry = chunk[cut + 1:]
+        yield chunk[:cut + 1]
+    if carry:
+        yield carry
 
 
 if __name__ == '__main__':